@@ -30,21 +30,21 @@
 import os
 import fnmatch
 
-try:
-    import indicate
-except ImportError:
-    pass
-import dbus
+import glib
 import gtk
 
+from compat import detect_playlist_access
 from mpris2 import Mpris2Adapter
 from mpris2 import ORG_MPRIS_MEDIAPLAYER2
 from mpris2 import ORG_MPRIS_MEDIAPLAYER2_PLAYER
 from mpris2 import ORG_MPRIS_MEDIAPLAYER2_TRACKLIST
 from mpris2 import MICROSECOND
+from mpris2 import NANOSECOND
+from stats import STATS, TRACE
+from transport import TRANSPORT_OPTION, create_transport
 
-from xl import event, settings
-from xl.player import PLAYER
+from xl import event, settings, xdg
+from xl.player import PLAYER, QUEUE
 
 MPRIS2 = None
 _WINDOW_STATE_HANDLER = None
@@ -59,7 +59,6 @@ def _enable(nothing, exaile, nothing2):
     MPRIS2 = Mpris2Manager(exaile)
     MPRIS2.acquire()
     MPRIS2.register_events()
-    init_indicate()
     event.add_callback(_clean_tmp, 'quit_application')
 #    _WINDOW_STATE_HANDLER = exaile.gui.main.window.connect("window_state_event", _destroy_window_and_tray, exaile)
     _WINDOW_STATE_HANDLER = exaile.gui.main.window.connect("delete-event", _delete_event, exaile)
@@ -99,14 +98,22 @@ def _destroy_window_and_tray(window, event, exaile):
         window.deiconify()
 
 def _clean_tmp(type, exaile, data):
-    tmpdir = os.path.expanduser('~/.cache/exaile/')
+    if MPRIS2 is not None:
+        MPRIS2.adapter.cover_cache.cleanup()
+    _clean_legacy_covers()
+
+def _clean_legacy_covers():
+    # covers exported by older versions, straight into the cache directory
+    tmpdir = xdg.get_cache_dir()
     for tmp in os.listdir(tmpdir):
-        if fnmatch.fnmatch(tmp, 'exaile-soundmenu*'):
+        if fnmatch.fnmatch(tmp, 'exaile-soundmenu*') or \
+                fnmatch.fnmatch(tmp, 'cover-*'):
             os.remove(os.path.join(tmpdir, tmp))
 
 def init_indicate():
     ## for Maverick registration
     try:
+        import indicate
         server = indicate.indicate_server_ref_default()
         server.set_type('music.exaile')
         server.set_desktop_file('/usr/share/applications/exaile.desktop')
@@ -115,61 +122,80 @@ def init_indicate():
         pass
 
 DBUS_OBJECT_NAME = 'org.mpris.MediaPlayer2.exaile'
+DBUS_OBJECT_PATH = '/org/mpris/MediaPlayer2'
+
+# finish starting up when Exaile is idle instead of while it is loading
+LAZY_STARTUP_OPTION = 'plugin/soundmenu/lazy_startup'
 
 class Mpris2Manager(object):
     def __init__(self, exaile):
         self.exaile = exaile
-        self.bus = None
+        self.transport = None
+        self.adapter = None
+        self.playlist_access = None
+        self._startup_source = None
+        self._callbacks = []
 
     def acquire(self):
-        if self.bus:
-            self.bus.get_bus().request_name(DBUS_OBJECT_NAME)
+        self.playlist_access = detect_playlist_access(QUEUE.current_playlist)
+        self.adapter = Mpris2Adapter(self.exaile, self.playlist_access)
+        self.transport = create_transport(self.adapter,
+                settings.get_option(TRANSPORT_OPTION, 'auto'))
+        self.transport.start(DBUS_OBJECT_NAME, DBUS_OBJECT_PATH)
+        if settings.get_option(LAZY_STARTUP_OPTION, True):
+            self._startup_source = glib.idle_add(self._on_startup_idle,
+                    priority=glib.PRIORITY_LOW)
         else:
-            self.bus = dbus.service.BusName(DBUS_OBJECT_NAME, bus=dbus.SessionBus())
-        self.adapter = Mpris2Adapter(self.exaile, self.bus)
-        ### for Natty registration
-        self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2, 'DesktopEntry')
-        self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER,
+            self.startup()
+
+    def startup(self):
+        """ the parts of enabling the plugin that can wait """
+        ### for Natty registration, sent whether anybody called in or not
+        self.adapter.announce(ORG_MPRIS_MEDIAPLAYER2, 'DesktopEntry')
+        self.adapter.announce(ORG_MPRIS_MEDIAPLAYER2_PLAYER,
                 'PlaybackStatus', 'Metadata', 'CanGoNext', 'CanGoPrevious',
                 'CanPause', 'CanPlay')
+        init_indicate()
+        _clean_legacy_covers()
+        self.adapter.discover_formats()
+
+    def _on_startup_idle(self):
+        self._startup_source = None
+        self.startup()
+        return False
 
     def register_events(self):
-        event.add_callback(self.on_playback_start, 'playback_track_start')
-        event.add_callback(self.on_playback_start, 'playback_player_start')
-        event.add_callback(self.on_playback_end, 'playback_track_end')
-        event.add_callback(self.on_playback_pause, 'playback_player_pause')
-        event.add_callback(self.on_playback_pause, 'playback_toggle_pause')
-        event.add_callback(self.on_tags_update, 'track_tags_changed')
-        event.add_callback(self.on_option_change, 'option_set')
-        # <= 0.3.2
-        event.add_callback(self.on_playlist_change, 'tracks_reordered')
-        # >= 0.3.3
-        event.add_callback(self.on_playlist_change, 'playlist_current_position_changed')
-        event.add_callback(self.on_shuffle_change, 'playlist_shuffle_mode_changed')
-        event.add_callback(self.on_repeat_change, 'playlist_repeat_mode_changed')
-        event.add_callback(self.on_seek, 'playback_seeked')
+        # event callbacks are timed (and traced), keep the wrappers to
+        # remove them later
+        self._callbacks = [
+                (STATS.wrap('event.%s' % name,
+                    self._traced(name, getattr(self, handler))), name)
+                for name, handler in self.playlist_access.events]
+        for callback, name in self._callbacks:
+            event.add_callback(callback, name)
 
     def release(self):
+        if self._startup_source is not None:
+            glib.source_remove(self._startup_source)
+            self._startup_source = None
         if self.adapter is not None:
-            self.adapter.remove_from_connection()
-        if self.bus is not None:
-            self.bus.get_bus().release_name(self.bus.get_name())
+            self.adapter.shutdown()
+            self.adapter.cover_cache.save()
+        if self.transport is not None:
+            self.transport.stop()
+            self.transport = None
+
+    def _traced(self, name, handler):
+        def traced(evt, obj, data):
+            if TRACE.enabled:
+                TRACE.add('event', name)
+            return handler(evt, obj, data)
+        return traced
 
     def unregister_events(self):
-        event.remove_callback(self.on_playback_start, 'playback_track_start')
-        event.remove_callback(self.on_playback_start, 'playback_player_start')
-        event.remove_callback(self.on_playback_end, 'playback_track_end')
-        event.remove_callback(self.on_playback_pause, 'playback_player_pause')
-        event.remove_callback(self.on_playback_pause, 'playback_toggle_pause')
-        event.remove_callback(self.on_tags_update, 'track_tags_changed')
-        event.remove_callback(self.on_option_change, 'option_set')
-        # <= 0.3.2
-        event.remove_callback(self.on_playlist_change, 'tracks_reordered')
-        # >= 0.3.3
-        event.remove_callback(self.on_playlist_change, 'playlist_current_position_changed')
-        event.remove_callback(self.on_shuffle_change, 'playlist_shuffle_mode_changed')
-        event.remove_callback(self.on_repeat_change, 'playlist_repeat_mode_changed')
-        event.remove_callback(self.on_seek, 'playback_seeked')
+        for callback, name in self._callbacks:
+            event.remove_callback(callback, name)
+        self._callbacks = []
 
     def on_playback_start(self, evt, exaile, data):
         # When looping a playlist, this is called a bit too early, causing the
@@ -177,43 +203,67 @@ class Mpris2Manager(object):
         # always be playing after this event.
         self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER,
                 ('PlaybackStatus', 'Playing'), 'Metadata', 'CanGoNext', 'CanGoPrevious',
-                'CanPause', 'CanPlay')
+                'CanPause', 'CanPlay', 'LoopStatus', 'Shuffle')
+        self.adapter.position.resync(playing=True)
+        self.adapter.prefetcher.schedule()
+        self.adapter.tracklist.schedule_update()
 
     def on_playback_end(self, evt, exaile, data):
         self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER,
                 'PlaybackStatus', 'Metadata', 'CanGoNext', 'CanGoPrevious',
                 'CanPause', 'CanPlay')
+        self.adapter.position.stop()
 
     def on_playback_pause(self, evt, exaile, data):
         self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER,
                 'PlaybackStatus', 'CanPause', 'CanPlay')
+        self.adapter.position.resync()
 
     def on_tags_update(self, evt, track, data):
+        # the rating lives in the __rating tag, so this covers rating changes
+        self.adapter.invalidate_metadata(track)
+        self.adapter.tracklist.track_changed(track)
         if track == PLAYER.current:
             self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER, 'Metadata')
 
+    def on_cover_change(self, evt, cover_manager, track):
+        self.adapter.cover_changed(track)
+        self.adapter.tracklist.track_changed(track)
+        self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER, 'Metadata')
+
     def on_option_change(self, evt, settings_manager, data):
-        if data == 'playback/repeat':
-            # <= 0.3.2
-            self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER,
-                    'LoopStatus', 'CanGoNext', 'CanGoPrevious')
-        elif data == 'playback/shuffle':
-            # <= 0.3.2
-            self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER, 'Shuffle')
-        elif data == 'player/volume':
-            self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER, 'Volume')
+        props = self.playlist_access.options.get(data)
+        if props:
+            self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER, *props)
+            if 'Volume' not in props:
+                self.adapter.prefetcher.schedule()
 
     def on_shuffle_change(self, evt, playlist, data):
         # >= 0.3.3
         self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER, 'Shuffle')
+        self.adapter.prefetcher.schedule()
 
     def on_repeat_change(self, evt, playlist, data):
         # >= 0.3.3
         self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER,
                 'LoopStatus', 'CanGoNext', 'CanGoPrevious')
+        self.adapter.prefetcher.schedule()
+
+    def on_playlist_reorder(self, evt, playlist, unknown):
+        self.adapter.playlist_index.invalidate()
+        self.on_playlist_change(evt, playlist, unknown)
+
+    def on_playlist_tracks_added(self, evt, playlist, added):
+        # >= 0.3.3
+        self.adapter.playlist_index.tracks_added(playlist, added)
+        self.on_playlist_change(evt, playlist, added)
 
     def on_playlist_change(self, evt, playlist, unknown):
-        self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER, 'CanGoNext', 'CanGoPrevious')
+        self.adapter.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER,
+                'CanGoNext', 'CanGoPrevious', 'CanPlay')
+        self.adapter.prefetcher.schedule()
+        self.adapter.tracklist.schedule_update()
 
     def on_seek(self, evt, player, pos):
-        self.adapter.Seeked(pos * MICROSECOND)
+        self.adapter.position.seeked(pos * NANOSECOND)
+        self.adapter.seeked(pos * MICROSECOND)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+A polling MPRIS client, started by run.py as a separate process so that
+its blocking calls don't stall the main loop being measured.
+
+The latency of every call (in seconds) is written to --output as JSON.
+In listen mode it only reads the properties once, then stays on the bus
+(as a sound menu would) until it is terminated.
+"""
+
+import argparse
+import json
+import time
+
+import dbus
+
+BUS_NAME = 'org.mpris.MediaPlayer2.exaile'
+OBJECT_PATH = '/org/mpris/MediaPlayer2'
+PLAYER = 'org.mpris.MediaPlayer2.Player'
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--address', required=True)
+    parser.add_argument('--mode', default='getall',
+            choices=['getall', 'get', 'position', 'seek', 'next', 'listen'])
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.0,
+            help="seconds between calls")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    bus = dbus.bus.BusConnection(args.address)
+    obj = bus.get_object(BUS_NAME, OBJECT_PATH)
+    props = dbus.Interface(obj, dbus.PROPERTIES_IFACE)
+    player = dbus.Interface(obj, PLAYER)
+
+    if args.mode == 'listen':
+        props.GetAll(PLAYER)
+        while True:
+            time.sleep(60)
+
+    if args.mode == 'getall':
+        call = lambda: props.GetAll(PLAYER)
+    elif args.mode == 'get':
+        call = lambda: props.Get(PLAYER, 'Metadata')
+    elif args.mode == 'position':
+        call = lambda: props.Get(PLAYER, 'Position')
+    elif args.mode == 'seek':
+        call = lambda: player.Seek(dbus.Int64(100000))
+    else:
+        call = lambda: player.Next()
+
+    samples = []
+    for i in range(args.calls):
+        start = time.time()
+        call()
+        samples.append(time.time() - start)
+        if args.interval:
+            time.sleep(args.interval)
+
+    with open(args.output, 'w') as f:
+        json.dump(samples, f)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+"""
+In-process stand-ins for the parts of Exaile the plugin uses, so that it
+can be benchmarked without a running Exaile. Only what the plugin touches
+is implemented.
+"""
@@ -0,0 +1,20 @@
+"""
+Stand-in for xl.event: callbacks are run synchronously, in order.
+"""
+
+_callbacks = {}
+
+def add_callback(function, type, *args, **kwargs):
+    _callbacks.setdefault(type, []).append(function)
+
+def remove_callback(function, type, *args, **kwargs):
+    try:
+        _callbacks[type].remove(function)
+    except (KeyError, ValueError):
+        pass
+
+def log_event(type, obj, data):
+    for function in list(_callbacks.get(type, [])):
+        function(type, obj, data)
+
+log_event_sync = log_event
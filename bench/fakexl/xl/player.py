@@ -0,0 +1,194 @@
+"""
+Stand-in for xl.player: a fake pipeline, the play queue and synthetic
+playlists using the Exaile >= 0.3.3 playlist API.
+"""
+
+import random
+import time
+
+from xl import event, settings
+
+# seconds spent in each pipeline position query, like a real GStreamer
+# query costs some time
+QUERY_COST = 0.0002
+
+class Track(object):
+
+    def __init__(self, number, albums=1000):
+        album = number % albums
+        self.tags = {
+            '__loc': 'file:///music/%d/%d.flac' % (album, number),
+            'title': ['Track %d' % number],
+            'artist': ['Artist %d' % (album % 97)],
+            'album': ['Album %d' % album],
+            'genre': ['Genre %d' % (album % 13)],
+            '__length': 180 + number % 120,
+            '__rating': 0,
+        }
+
+    def get_tag_raw(self, tag):
+        return self.tags.get(tag)
+
+    def set_tag_raw(self, tag, value):
+        self.tags[tag] = value
+        event.log_event('track_tags_changed', self, tag)
+
+    def get_rating(self):
+        return self.tags.get('__rating', 0)
+
+class Playlist(list):
+
+    def __init__(self, tracks=()):
+        list.__init__(self, tracks)
+        self.current_position = -1
+        self._repeat = 'disabled'
+        self._shuffle = 'disabled'
+
+    def get_repeat_mode(self):
+        return self._repeat
+
+    def set_repeat_mode(self, mode):
+        self._repeat = mode
+        event.log_event('playlist_repeat_mode_changed', self, mode)
+
+    def get_shuffle_mode(self):
+        return self._shuffle
+
+    def set_shuffle_mode(self, mode):
+        self._shuffle = mode
+        event.log_event('playlist_shuffle_mode_changed', self, mode)
+
+    def extend(self, tracks):
+        start = len(self)
+        list.extend(self, tracks)
+        event.log_event('playlist_tracks_added', self,
+                list(enumerate(tracks, start)))
+
+    def shuffle_in_place(self, seed=0):
+        """ reorder everything, like a drag and drop of the whole list """
+        tracks = list(self)
+        random.Random(seed).shuffle(tracks)
+        removed = list(enumerate(self))
+        del self[:]
+        event.log_event('playlist_tracks_removed', self, removed)
+        list.extend(self, tracks)
+        event.log_event('playlist_tracks_added', self, list(enumerate(tracks)))
+
+def make_playlist(size, albums=1000):
+    return Playlist(Track(i, albums) for i in range(size))
+
+class Player(object):
+
+    def __init__(self):
+        self.current = None
+        self.state = 'stopped'
+        self.position_queries = 0
+        self.seeks = 0
+        self._position = 0.0
+        self._started = None
+
+    def is_playing(self):
+        return self.state == 'playing'
+
+    def is_paused(self):
+        return self.state == 'paused'
+
+    def is_stopped(self):
+        return self.state == 'stopped'
+
+    def get_position(self):
+        self.position_queries += 1
+        if QUERY_COST:
+            time.sleep(QUERY_COST)
+        return int(self._get_seconds() * 1000000000)
+
+    def _get_seconds(self):
+        if self.state == 'playing':
+            return self._position + time.time() - self._started
+        return self._position
+
+    def seek(self, value):
+        self.seeks += 1
+        self._position = value
+        self._started = time.time()
+        event.log_event('playback_seeked', self, value)
+
+    def play(self, track):
+        self.current = track
+        self.state = 'playing'
+        self._position = 0.0
+        self._started = time.time()
+        event.log_event('playback_track_start', self, track)
+
+    def pause(self):
+        if self.state == 'playing':
+            self._position = self._get_seconds()
+            self.state = 'paused'
+            event.log_event('playback_player_pause', self, self.current)
+
+    def toggle_pause(self):
+        if self.state == 'playing':
+            self.pause()
+        elif self.state == 'paused':
+            self.state = 'playing'
+            self._started = time.time()
+            event.log_event('playback_toggle_pause', self, self.current)
+
+    def stop(self):
+        track, self.current = self.current, None
+        self.state = 'stopped'
+        self._position = 0.0
+        event.log_event('playback_track_end', self, track)
+
+    def get_volume(self):
+        return settings.get_option('player/volume', 100.0)
+
+    def set_volume(self, volume):
+        settings.set_option('player/volume', volume)
+
+class PlayQueue(list):
+
+    def __init__(self, player):
+        list.__init__(self)
+        self.player = player
+        self.current_playlist = Playlist()
+
+    def set_current_playlist(self, playlist):
+        self.current_playlist = playlist
+
+    def play(self, track=None):
+        playlist = self.current_playlist
+        if track is None:
+            if not playlist:
+                return
+            if playlist.current_position < 0:
+                playlist.current_position = 0
+            track = playlist[playlist.current_position]
+        self.player.play(track)
+
+    def next(self):
+        if len(self):
+            self.player.play(self.pop(0))
+            return
+        playlist = self.current_playlist
+        if playlist.current_position + 1 < len(playlist):
+            self._move(playlist.current_position + 1)
+        elif playlist.get_repeat_mode() == 'all' and playlist:
+            self._move(0)
+        else:
+            self.player.stop()
+
+    def prev(self):
+        playlist = self.current_playlist
+        if playlist.current_position > 0:
+            self._move(playlist.current_position - 1)
+
+    def _move(self, position):
+        playlist = self.current_playlist
+        old, playlist.current_position = playlist.current_position, position
+        event.log_event('playlist_current_position_changed', playlist,
+                (position, old))
+        self.player.play(playlist[position])
+
+PLAYER = Player()
+QUEUE = PlayQueue(PLAYER)
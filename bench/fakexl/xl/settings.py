@@ -0,0 +1,16 @@
+"""
+Stand-in for xl.settings, backed by a dict; writes are counted.
+"""
+
+from xl import event
+
+OPTIONS = {}
+WRITES = [0]
+
+def get_option(option, default=None):
+    return OPTIONS.get(option, default)
+
+def set_option(option, value, save=True):
+    OPTIONS[option] = value
+    WRITES[0] += 1
+    event.log_event('option_set', None, option)
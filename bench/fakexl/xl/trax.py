@@ -0,0 +1,20 @@
+"""
+Stand-in for xl.trax: tracks are made up from their URI.
+"""
+
+import itertools
+import time
+
+from xl.player import Track
+
+# seconds spent reading the tags of each file
+READ_COST = 0.002
+
+_numbers = itertools.count(1000000)
+
+def get_tracks_from_uri(uri):
+    if READ_COST:
+        time.sleep(READ_COST)
+    track = Track(next(_numbers))
+    track.tags['__loc'] = uri
+    return [track]
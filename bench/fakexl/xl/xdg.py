@@ -0,0 +1,17 @@
+"""
+Stand-in for xl.xdg, rooted in $BENCH_HOME.
+"""
+
+import os
+import tempfile
+
+_home = os.environ.get('BENCH_HOME') or tempfile.mkdtemp(prefix='soundmenu-bench-')
+
+def get_cache_dir():
+    path = os.path.join(_home, 'cache')
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+def get_data_dir():
+    return os.path.join(_home, 'data')
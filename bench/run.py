@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the sound menu plugin.
+
+The plugin runs in this process against the stand-ins of bench/fakexl
+(player, queue, synthetic playlists and covers) and exports itself on a
+private dbus-daemon; clients polling it run as separate processes (see
+client.py). For each workload, latency percentiles of the D-Bus calls,
+event handlers and flushes are reported, along with the time spent in
+single main loop iterations (how long the UI would have been blocked).
+
+    python bench/run.py --tracks 1000,200000 --clients 4
+    python bench/run.py --transport gdbus,dbus-python
+    python bench/run.py --cover-export cache,runtime,data
+
+Needs what the plugin itself needs (dbus-python, PyGTK) and dbus-daemon;
+the GDBus transport can only be compared where the plugin runs on the gi
+bindings (PyGTK can't be loaded next to them).
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+
+sys.path.insert(0, os.path.join(BENCH_DIR, 'fakexl'))
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+
+import dbus
+import dbus.mainloop.glib
+import glib
+
+from xl import covers, settings
+from xl.player import PLAYER, QUEUE, make_playlist
+
+PLAYER_IFACE = 'org.mpris.MediaPlayer2.Player'
+
+## harness
+
+class Samples(object):
+    """ latencies (in seconds) by name """
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, name, value):
+        self.samples.setdefault(name, []).append(value)
+
+    def extend(self, name, values):
+        self.samples.setdefault(name, []).extend(values)
+
+    def timed(self, name, function, *args):
+        start = time.time()
+        result = function(*args)
+        self.add(name, time.time() - start)
+        return result
+
+    def report(self, title):
+        print("")
+        print(title)
+        print("  %-32s %7s %9s %9s %9s %9s" %
+                ('', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+        for name in sorted(self.samples):
+            values = sorted(self.samples[name])
+            pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+            print("  %-32s %7d %9.3f %9.3f %9.3f %9.3f" % (name, len(values),
+                pick(0.5) * 1000, pick(0.9) * 1000, pick(0.99) * 1000,
+                values[-1] * 1000))
+
+def start_bus():
+    """ start a private session bus, return the process and its address """
+    daemon = subprocess.Popen(['dbus-daemon', '--session', '--nofork',
+        '--print-address'], stdout=subprocess.PIPE)
+    address = daemon.stdout.readline().strip()
+    if not isinstance(address, str):
+        address = address.decode('ascii')
+    os.environ['DBUS_SESSION_BUS_ADDRESS'] = address
+    return daemon, address
+
+def iterate(samples, seconds=0.0, until=None):
+    """ run the main loop until nothing is pending and seconds elapsed (or
+        until() is true), timing every iteration """
+    context = glib.main_context_default()
+    deadline = time.time() + seconds
+    while True:
+        if context.pending():
+            start = time.time()
+            context.iteration(False)
+            samples.add('main_loop.iteration', time.time() - start)
+        elif until is not None and until():
+            return
+        elif until is None and time.time() >= deadline:
+            return
+        else:
+            time.sleep(0.0005)
+
+def run_clients(ctx, samples, mode, clients, calls, interval=0.0):
+    """ poll the plugin from separate processes while running the loop """
+    outputs = []
+    processes = []
+    for i in range(clients):
+        fd, output = tempfile.mkstemp(prefix='soundmenu-bench-')
+        os.close(fd)
+        outputs.append(output)
+        processes.append(subprocess.Popen([sys.executable,
+            os.path.join(BENCH_DIR, 'client.py'), '--address', ctx.address,
+            '--mode', mode, '--calls', str(calls), '--interval', str(interval),
+            '--output', output]))
+    iterate(samples, until=lambda: all(p.poll() is not None for p in processes))
+    for output in outputs:
+        try:
+            with open(output) as f:
+                samples.extend('dbus.%s' % mode, json.load(f))
+        except ValueError:
+            print("  a %s client failed" % mode)
+        os.remove(output)
+
+def start_listeners(ctx, samples, count):
+    """ clients staying on the bus, without them nothing is emitted """
+    processes = [subprocess.Popen([sys.executable,
+        os.path.join(BENCH_DIR, 'client.py'), '--address', ctx.address,
+        '--mode', 'listen']) for i in range(count)]
+    iterate(samples, until=lambda: len(ctx.adapter.listeners) >= count)
+    return processes
+
+class FakeWindow(object):
+    def connect(self, *args):
+        return 0
+
+    def disconnect(self, handler):
+        pass
+
+class FakeExaile(object):
+    """ just enough of the Exaile object for enable()/disable() """
+
+    loading = False
+
+    def __init__(self):
+        main = type('Main', (object,), {})()
+        main.window = FakeWindow()
+        main.controller = type('Controller', (object,), {})()
+        self.gui = type('Gui', (object,), {})()
+        self.gui.main = main
+        self.player = PLAYER
+
+    def quit(self):
+        pass
+
+class Context(object):
+    pass
+
+## workloads
+
+def track_changes(ctx, samples):
+    for i in range(200):
+        samples.timed('event.track_change', QUEUE.next)
+        samples.timed('flush.track_change', iterate, samples)
+    # let the covers of the last tracks arrive
+    iterate(samples, 0.5)
+
+def seek_storm(ctx, samples):
+    for i in range(200):
+        samples.timed('event.seek', PLAYER.seek, random.uniform(0, 120))
+    iterate(samples, 0.2)
+    run_clients(ctx, samples, 'seek', ctx.clients, 50)
+
+def getall_polling(ctx, samples):
+    run_clients(ctx, samples, 'getall', ctx.clients, 200)
+
+def get_polling(ctx, samples):
+    run_clients(ctx, samples, 'get', ctx.clients, 200)
+    run_clients(ctx, samples, 'position', ctx.clients, 200, interval=0.005)
+
+def bulk_tag_edit(ctx, samples):
+    playlist = QUEUE.current_playlist
+    start = time.time()
+    for track in playlist[:1000]:
+        track.set_tag_raw('title', ['Edited %s' % track.get_tag_raw('__loc')])
+    samples.add('event.tag_edit_1000', time.time() - start)
+    samples.timed('flush.tag_edit_1000', iterate, samples)
+
+def playlist_reorder(ctx, samples):
+    for i in range(10):
+        samples.timed('event.reorder', QUEUE.current_playlist.shuffle_in_place, i)
+        samples.timed('flush.reorder', iterate, samples)
+        # the first lookup after a reorder pays for the index rebuild
+        samples.timed('property.CanGoNext', lambda: ctx.adapter.CanGoNext)
+
+def populate(ctx, samples):
+    adapter = ctx.adapter
+    names = adapter._properties[PLAYER_IFACE]
+    for i in range(200):
+        adapter.invalidate_metadata()
+        samples.timed('populate.cold', adapter.populate, PLAYER_IFACE, *names)
+        samples.timed('flush.cold', adapter.flush)
+        samples.timed('populate.warm', adapter.populate, PLAYER_IFACE, *names)
+        samples.timed('flush.warm', adapter.flush)
+
+def bulk_enqueue(ctx, samples):
+    # a playlist built over MPRIS, the main loop should keep running while
+    # the tags are read
+    finished = []
+    ctx.adapter.EnqueueFinished = lambda job, added: finished.append(job)
+    uris = ['file:///enqueued/%d.flac' % i for i in range(1000)]
+    start = time.time()
+    ctx.adapter.EnqueueUris(uris, False)
+    iterate(samples, until=lambda: finished)
+    samples.add('enqueue.1000_uris', time.time() - start)
+    del ctx.adapter.EnqueueFinished
+
+def cover_export(ctx, samples):
+    # covers the cache has never seen, exported one after the other as
+    # the cover workers would; the cover_export backends differ in where
+    # (and whether) the exported image is written
+    cache = ctx.adapter.cover_cache
+    cache.ensure_loaded()
+    token = '%08x' % random.getrandbits(32)
+    lengths = []
+    for i in range(200):
+        data = covers.make_png(covers.COVER_SIZE, i, '%s-%d' % (token, i))
+        url = samples.timed('cover.store', cache.store,
+                'file:///exported/%s/%d.flac' % (token, i), data)
+        lengths.append(len(url or ''))
+    samples.timed('cover.save_index', cache.save)
+    ctx.cover_url_length = sum(lengths) // len(lengths)
+    # artUrl is in every Metadata reply, inline covers make them larger
+    run_clients(ctx, samples, 'get', ctx.clients, 200)
+
+def next_presses(ctx, samples):
+    # bursts of Next from every client, replies shouldn't wait for the
+    # tracks to start
+    run_clients(ctx, samples, 'next', ctx.clients, 20)
+    iterate(samples, 0.2)
+
+WORKLOADS = [
+    ('track_changes', track_changes),
+    ('seek_storm', seek_storm),
+    ('getall_polling', getall_polling),
+    ('get_polling', get_polling),
+    ('bulk_tag_edit', bulk_tag_edit),
+    ('playlist_reorder', playlist_reorder),
+    ('populate', populate),
+    ('bulk_enqueue', bulk_enqueue),
+    ('cover_export', cover_export),
+    ('next_presses', next_presses),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--tracks', default='1000,10000,200000',
+            help="comma separated playlist sizes")
+    parser.add_argument('--clients', type=int, default=4,
+            help="number of polling client processes")
+    parser.add_argument('--workloads', default=','.join(n for n, w in WORKLOADS))
+    parser.add_argument('--option', action='append', default=[],
+            metavar='NAME=JSON', help="set a plugin option, "
+            "e.g. plugin/soundmenu/emit_delay=20")
+    parser.add_argument('--listeners', type=int, default=1,
+            help="number of idle clients listening to signals")
+    parser.add_argument('--transport', default='auto',
+            help="comma separated transports to run the workloads on: "
+            "auto, gdbus, dbus-python")
+    parser.add_argument('--cover-export', default='cache',
+            help="comma separated cover export backends to run the "
+            "workloads with: cache, runtime, data")
+    args = parser.parse_args()
+
+    for option in args.option:
+        name, value = option.split('=', 1)
+        settings.OPTIONS[name] = json.loads(value)
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    daemon, address = start_bus()
+    plugin = __import__(os.path.basename(PLUGIN_DIR))
+    selected = args.workloads.split(',')
+    runs = [(transport, cover_export, int(size))
+            for transport in args.transport.split(',')
+            for cover_export in args.cover_export.split(',')
+            for size in args.tracks.split(',')]
+    try:
+        for transport, cover_export, size in runs:
+            settings.OPTIONS['plugin/soundmenu/transport'] = transport
+            settings.OPTIONS['plugin/soundmenu/cover_export'] = cover_export
+            ctx = Context()
+            ctx.address = address
+            ctx.clients = args.clients
+            ctx.cover_url_length = None
+            QUEUE.set_current_playlist(make_playlist(size))
+            QUEUE.play()
+            PLAYER.position_queries = PLAYER.seeks = 0
+            covers.MANAGER.fetches = settings.WRITES[0] = 0
+
+            plugin.STATS.reset()
+            exaile = FakeExaile()
+            samples = Samples()
+            samples.timed('plugin.enable', plugin.enable, exaile)
+            ctx.adapter = plugin.MPRIS2.adapter
+            iterate(samples, 0.2)
+            listeners = start_listeners(ctx, samples, args.listeners)
+
+            for name, workload in WORKLOADS:
+                if name in selected:
+                    workload(ctx, samples)
+
+            samples.report("%d tracks, %s, %s covers" % (size,
+                plugin.MPRIS2.transport.name, cover_export))
+            summary = plugin.STATS.get_summary()
+            for name in sorted(summary):
+                if name.startswith('command.'):
+                    print("  %-32s %7d %9.3f %9.3f %9.3f (mean, p95, max ms)" % (
+                        name, summary[name]['count'], summary[name]['mean_ms'],
+                        summary[name]['p95_ms'], summary[name]['max_ms']))
+            print("  commands merged: %d" %
+                    summary['counters'].get('command.merged', 0))
+            print("  position queries: %d, seeks: %d, cover fetches: %d, "
+                    "settings writes: %d" % (PLAYER.position_queries,
+                        PLAYER.seeks, covers.MANAGER.fetches,
+                        settings.WRITES[0]))
+            print("  properties emitted: %(emitted)d, suppressed: %(suppressed)d, "
+                    "Seeked signals: %(seeked)d" % ctx.adapter.emit_stats)
+            if ctx.cover_url_length is not None:
+                print("  cover directory: %s, mean artUrl length: %d" % (
+                    ctx.adapter.cover_cache.directory, ctx.cover_url_length))
+            for process in listeners:
+                process.terminate()
+                process.wait()
+            plugin.disable(exaile)
+            PLAYER.stop()
+    finally:
+        daemon.terminate()
+
+if __name__ == '__main__':
+    main()
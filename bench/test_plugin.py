@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+"""
+Unit tests for the parts of the plugin that don't need a bus, run against
+the stand-ins of bench/fakexl and a main loop driven by hand (the static
+glib bindings aren't needed):
+
+    python bench/test_plugin.py
+    python -m unittest discover -s bench
+
+(pytest would import the plugin package itself, which needs PyGTK.)
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+
+os.environ.setdefault('BENCH_HOME', tempfile.mkdtemp(prefix='soundmenu-test-'))
+sys.path.insert(0, os.path.join(BENCH_DIR, 'fakexl'))
+sys.path.insert(0, PLUGIN_DIR)
+
+## main loop
+
+class Loop(object):
+    """ idle and timeout sources, dispatched by iterate() """
+
+    def __init__(self):
+        self.sources = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def add(self, *args, **kwargs):
+        if args and not callable(args[0]):
+            # the interval of timeout_add
+            args = args[1:]
+        with self.lock:
+            source = self.next_id
+            self.next_id += 1
+            self.sources[source] = args
+        return source
+
+    def remove(self, source):
+        with self.lock:
+            self.sources.pop(source, None)
+
+    def iterate(self):
+        """ run every source added so far once """
+        with self.lock:
+            pending = sorted(self.sources.items())
+        for source, args in pending:
+            if source not in self.sources:
+                continue
+            if args[0](*args[1:]) is not True:
+                self.remove(source)
+
+    def run_until(self, condition, timeout=5.0):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                raise AssertionError("timed out")
+            self.iterate()
+            time.sleep(0.001)
+
+LOOP = Loop()
+glib = types.ModuleType('glib')
+glib.idle_add = glib.timeout_add = glib.timeout_add_seconds = LOOP.add
+glib.source_remove = LOOP.remove
+glib.PRIORITY_LOW = 300
+glib.PRIORITY_DEFAULT = 0
+sys.modules['glib'] = glib
+
+# the failures provoked here are logged with their tracebacks
+logging.disable(logging.CRITICAL)
+
+from xl import covers, settings
+from xl.player import PLAYER, QUEUE, make_playlist
+
+import compat
+import enqueue
+import formats
+import mpris2
+import transport
+from commands import CommandQueue
+from covercache import CoverCache
+from throttle import Throttle
+from tracklist import TrackListWindow
+from workers import WorkerPool
+
+class LoopTestCase(unittest.TestCase):
+
+    def setUp(self):
+        LOOP.sources.clear()
+
+## tests
+
+class ThrottleTest(LoopTestCase):
+
+    def test_leading_and_trailing(self):
+        values = []
+        settled = []
+        throttle = Throttle(100, values.append, lambda: settled.append(1))
+        self.assertTrue(throttle.push(1))
+        self.assertFalse(throttle.push(2))
+        self.assertFalse(throttle.push(3))
+        self.assertEqual(values, [1])
+        LOOP.iterate()
+        self.assertEqual(values, [1, 3])
+        self.assertEqual(settled, [])
+        LOOP.iterate()
+        self.assertEqual(settled, [1])
+        self.assertTrue(throttle.push(4))
+
+    def test_failed_trailing_call(self):
+        values = []
+        def callback(value):
+            values.append(float(value))
+        throttle = Throttle(100, callback)
+        throttle.push(1)
+        throttle.push('x')
+        LOOP.iterate()
+        throttle.push(0.5)
+        LOOP.iterate()
+        self.assertEqual(values, [1.0, 0.5])
+
+class CommandQueueTest(LoopTestCase):
+
+    def setUp(self):
+        LoopTestCase.setUp(self)
+        self.run = []
+        self.queue = CommandQueue(lambda name, arg: self.run.append((name, arg)))
+
+    def test_skips_add_up(self):
+        for i in range(3):
+            self.queue.push('skip', 1)
+        self.queue.push('skip', -1)
+        LOOP.run_until(lambda: not LOOP.sources)
+        self.assertEqual(self.run, [('skip', 2)])
+
+    def test_skips_cancel_out(self):
+        self.queue.push('skip', 1)
+        self.queue.push('skip', -1)
+        LOOP.run_until(lambda: not LOOP.sources)
+        self.assertEqual(self.run, [])
+
+    def test_states(self):
+        self.queue.push('state', 'Playing')
+        self.queue.push('state', 'Toggle')
+        self.queue.push('skip', 1)
+        self.queue.push('state', 'Toggle')
+        self.queue.push('state', 'Toggle')
+        LOOP.run_until(lambda: not LOOP.sources)
+        self.assertEqual(self.run, [('state', 'Paused'), ('skip', 1)])
+
+class PlaylistIndexTest(unittest.TestCase):
+
+    def test_index(self):
+        playlist = make_playlist(10)
+        index = mpris2.PlaylistIndex()
+        self.assertEqual(index.index(playlist, playlist[7]), 7)
+        self.assertRaises(ValueError, index.index, playlist,
+                make_playlist(20)[15])
+
+    def test_tracks_added(self):
+        playlist = make_playlist(10)
+        index = mpris2.PlaylistIndex()
+        index.index(playlist, playlist[0])
+        added = make_playlist(12)[10:]
+        list.extend(playlist, added)
+        index.tracks_added(playlist, list(enumerate(added, 10)))
+        self.assertEqual(index.index(playlist, added[1]), 11)
+
+    def test_unannounced_change(self):
+        playlist = make_playlist(10)
+        index = mpris2.PlaylistIndex()
+        index.index(playlist, playlist[0])
+        playlist.reverse()
+        self.assertEqual(index.index(playlist, playlist[2]), 2)
+
+class CoverCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='soundmenu-covers-')
+
+    def make_cache(self, **kwargs):
+        return CoverCache(self.directory, 1024 * 1024, 3, **kwargs)
+
+    def cover(self, seed):
+        return covers.make_png(8, seed, 'test-%d' % seed)
+
+    def test_eviction(self):
+        cache = self.make_cache()
+        for i in range(3):
+            cache.store('loc%d' % i, self.cover(i))
+        # the oldest one was used last
+        self.assertTrue(cache.lookup('loc0'))
+        cache.store('loc3', self.cover(3))
+        self.assertIsNone(cache.lookup('loc1'))
+        self.assertTrue(cache.lookup('loc0'))
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+
+    def test_reload(self):
+        cache = self.make_cache()
+        url = cache.store('loc', self.cover(1))
+        cache.alias('other', 'loc')
+        cache.save()
+        cache = self.make_cache()
+        self.assertIsNone(cache.lookup('loc'))
+        cache.ensure_loaded()
+        self.assertEqual(cache.lookup('loc'), url)
+        self.assertEqual(cache.lookup('other'), url)
+
+    def test_invalidate(self):
+        cache = self.make_cache()
+        cache.store('loc', self.cover(1))
+        cache.alias('other', 'loc')
+        cache.store('unrelated', self.cover(2))
+        cache.save()
+        cache = self.make_cache()
+        cache.invalidate('loc')
+        cache.ensure_loaded()
+        self.assertIsNone(cache.lookup('loc'))
+        self.assertIsNone(cache.lookup('other'))
+        self.assertTrue(cache.lookup('unrelated'))
+
+    def test_inline(self):
+        cache = self.make_cache(inline_max=4096)
+        url = cache.store('loc', self.cover(1))
+        self.assertTrue(url.startswith('data:image/png;base64,'))
+        cache.save()
+        self.assertEqual(os.listdir(self.directory), ['index.json'])
+        cache = self.make_cache(inline_max=4096)
+        cache.ensure_loaded()
+        self.assertIsNone(cache.lookup('loc'))
+
+class FakeTrackListAdapter(object):
+
+    def __init__(self):
+        self.signals = []
+        self.index = mpris2.PlaylistIndex()
+
+    def has_listeners(self):
+        return True
+
+    def _get_position(self, track):
+        return self.index.index(QUEUE.current_playlist, track)
+
+    def _get_trackid(self, track):
+        return '/track/%s' % track.get_tag_raw('title')[0].split()[-1]
+
+    def _get_metadata(self, track):
+        return {'mpris:trackid': self._get_trackid(track)}
+
+    def TrackListReplaced(self, ids, current):
+        self.signals.append(('replaced', len(ids), current))
+
+    def TrackAdded(self, metadata, after):
+        self.signals.append(('added', metadata['mpris:trackid'], after))
+
+    def TrackRemoved(self, trackid):
+        self.signals.append(('removed', trackid))
+
+    def invalidate_tracks(self):
+        pass
+
+class TrackListWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        QUEUE.set_current_playlist(make_playlist(20))
+        PLAYER.current = QUEUE.current_playlist[10]
+        self.adapter = FakeTrackListAdapter()
+        self.window = TrackListWindow(self.adapter, 5)
+
+    def tearDown(self):
+        PLAYER.current = None
+
+    def test_first_update_replaces(self):
+        self.window.update()
+        self.assertEqual(self.adapter.signals, [('replaced', 5, '/track/10')])
+        self.window.update()
+        self.assertEqual(len(self.adapter.signals), 1)
+
+    def test_step(self):
+        self.window.update()
+        del self.adapter.signals[:]
+        PLAYER.current = QUEUE.current_playlist[11]
+        self.window.update()
+        self.assertEqual(self.adapter.signals, [('removed', '/track/8'),
+            ('added', '/track/13', '/track/12')])
+
+    def test_reorder_replaces(self):
+        self.window.update()
+        del self.adapter.signals[:]
+        QUEUE.current_playlist.reverse()
+        self.adapter.index.invalidate()
+        self.window.update()
+        self.assertEqual(self.adapter.signals[0][0], 'replaced')
+
+class TransportTest(unittest.TestCase):
+
+    def test_split_signature(self):
+        self.assertEqual(transport.split_signature('sa{sv}(ii)asx'),
+                ['s', 'a{sv}', '(ii)', 'as', 'x'])
+        self.assertEqual(transport.split_signature('aa{s(ai)}'),
+                ['aa{s(ai)}'])
+
+    def test_guess_signature(self):
+        self.assertEqual(transport.guess_signature(True), 'b')
+        self.assertEqual(transport.guess_signature(3), 'x')
+        self.assertEqual(transport.guess_signature(['a']), 'as')
+        self.assertEqual(transport.guess_signature({'a': 1}), 'a{sv}')
+
+    def test_variant_types(self):
+        converted = []
+        class Recorder(transport.Marshaller):
+            def variant(self, signature, value):
+                converted.append(signature)
+                return (signature, value)
+        marshaller = Recorder({'Volume': 'd', 'xesam:artist': 'as'})
+        metadata = {'xesam:artist': ['A'], 'mpris:length': 5}
+        result = marshaller.convert('v', metadata, 'Metadata')
+        self.assertEqual(result[0], 'a{sv}')
+        self.assertEqual(result[1]['xesam:artist'], ('as', ['A']))
+        self.assertEqual(result[1]['mpris:length'], ('x', 5))
+        # the same value isn't converted again
+        count = len(converted)
+        self.assertIs(marshaller.convert('v', metadata, 'Metadata'), result)
+        self.assertEqual(len(converted), count)
+
+    def test_create_transport_fallback(self):
+        # the static glib is loaded (here a stand-in named like it), gi
+        # can't be used next to it
+        self.assertFalse(transport.gdbus_available())
+
+class FormatsTest(unittest.TestCase):
+
+    def test_caps_to_mime_types(self):
+        self.assertEqual(formats.caps_to_mime_types(['audio/x-flac',
+            'audio/x-raw-int', 'audio/mpeg', 'video/x-h264']),
+            ['audio/flac', 'audio/mpeg', 'audio/x-flac'])
+
+class WorkerPoolTest(LoopTestCase):
+
+    def test_errback(self):
+        pool = WorkerPool('test', 1)
+        results = []
+        pool.submit(lambda: 1 // 0, (), results.append,
+                lambda ex: results.append(type(ex)))
+        pool.submit(lambda: 2, (), results.append)
+        try:
+            LOOP.run_until(lambda: len(results) == 2)
+        finally:
+            pool.stop()
+        self.assertEqual(results, [ZeroDivisionError, 2])
+
+class FailingPool(object):
+    """ runs jobs right away, failing the second one """
+
+    def __init__(self):
+        self.jobs = 0
+
+    def submit(self, func, args=(), callback=None, errback=None):
+        self.jobs += 1
+        if self.jobs == 2:
+            errback(IOError("unreadable"))
+        else:
+            callback(func(*args))
+
+class FakeEnqueueAdapter(object):
+
+    def __init__(self):
+        self.playlist_access = compat.PlaylistAccess()
+        self.finished = []
+
+    def _get_position(self, track):
+        return QUEUE.current_playlist.index(track)
+
+    def EnqueueProgress(self, job, done, total):
+        pass
+
+    def EnqueueFinished(self, job, added):
+        self.finished.append((job, added))
+
+class EnqueuerTest(unittest.TestCase):
+
+    def test_failed_chunk(self):
+        QUEUE.set_current_playlist(make_playlist(0))
+        adapter = FakeEnqueueAdapter()
+        enqueuer = enqueue.Enqueuer(adapter, FailingPool())
+        uris = ['file:///enqueued/%d.flac' % i
+                for i in range(enqueue.CHUNK_SIZE * 3)]
+        job = enqueuer.enqueue(uris)
+        self.assertEqual(adapter.finished,
+                [(job, enqueue.CHUNK_SIZE * 2)])
+        self.assertEqual(len(QUEUE.current_playlist), enqueue.CHUNK_SIZE * 2)
+
+class AdapterTest(LoopTestCase):
+
+    def setUp(self):
+        LoopTestCase.setUp(self)
+        settings.OPTIONS[mpris2.COVER_SIZE_OPTION] = 0
+        QUEUE.set_current_playlist(make_playlist(20, albums=5))
+        self.adapter = mpris2.Mpris2Adapter(None,
+                compat.detect_playlist_access(QUEUE.current_playlist))
+        self.get_cover = covers.MANAGER.get_cover
+
+    def tearDown(self):
+        covers.MANAGER.get_cover = self.get_cover
+        self.adapter.shutdown()
+        del settings.OPTIONS[mpris2.COVER_SIZE_OPTION]
+
+    def test_playlist_switch(self):
+        player = mpris2.ORG_MPRIS_MEDIAPLAYER2_PLAYER
+        self.assertEqual(self.adapter.Get(player, 'LoopStatus'), 'None')
+        self.assertEqual(self.adapter.Get(player, 'Shuffle'), False)
+        playlist = make_playlist(3)
+        playlist.set_repeat_mode('all')
+        playlist.set_shuffle_mode('track')
+        QUEUE.set_current_playlist(playlist)
+        self.assertEqual(self.adapter.Get(player, 'LoopStatus'), 'Playlist')
+        self.assertEqual(self.adapter.GetAll(player)['Shuffle'], True)
+
+    def test_set_errors(self):
+        player = mpris2.ORG_MPRIS_MEDIAPLAYER2_PLAYER
+        self.assertRaises(mpris2.PropertyReadOnly, self.adapter.Set,
+                player, 'Metadata', {})
+        self.assertRaises(mpris2.UnknownProperty, self.adapter.Set,
+                player, 'Nothing', 1)
+        self.assertRaises(mpris2.UnknownProperty, self.adapter.Get,
+                player, 'Nothing')
+        self.assertEqual(transport.Transport.error_name(
+            mpris2.UnknownProperty()),
+            'org.freedesktop.DBus.Error.UnknownProperty')
+
+    def test_failed_cover(self):
+        def get_cover(track, *args, **kwargs):
+            raise IOError("provider timed out")
+        covers.MANAGER.get_cover = get_cover
+        track = QUEUE.current_playlist[0]
+        self.assertIsNone(self.adapter._get_cover_url(track))
+        LOOP.run_until(lambda: not self.adapter._covers_in_flight)
+        loc = track.get_tag_raw('__loc')
+        self.assertNotIn(loc, self.adapter._no_cover)
+        # tried again
+        covers.MANAGER.get_cover = self.get_cover
+        self.adapter._get_cover_url(track)
+        LOOP.run_until(lambda: not self.adapter._covers_in_flight)
+        self.assertTrue(self.adapter.cover_cache.lookup(loc))
+
+    def test_no_cover_stays_with_its_track(self):
+        playlist = QUEUE.current_playlist
+        # the same album
+        first, second = playlist[0], playlist[5]
+        def get_cover(track, *args, **kwargs):
+            if track is first:
+                return None
+            return self.get_cover(track)
+        covers.MANAGER.get_cover = get_cover
+        self.adapter._get_cover_url(first)
+        self.adapter._get_cover_url(second)
+        LOOP.run_until(lambda: not self.adapter._covers_in_flight)
+        self.assertEqual(self.adapter._no_cover,
+                set([first.get_tag_raw('__loc')]))
+        self.assertTrue(self.adapter.cover_cache.lookup(
+            second.get_tag_raw('__loc')))
+
+if __name__ == '__main__':
+    unittest.main()
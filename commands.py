@@ -0,0 +1,114 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import collections
+import glib
+import logging
+import time
+
+from stats import STATS, TRACE
+
+logger = logging.getLogger(__name__)
+
+class CommandQueue(object):
+    """ player commands received over D-Bus, run in order on the main loop
+
+        Methods only queue their command and return, so the caller gets
+        its reply right away. A command is merged with the one queued
+        right before it when they are of the same kind:
+
+        - skips add up (five Next make a skip of five, Next then Previous
+          nothing at all)
+        - playback states: the last absolute one wins (Play then Pause is
+          just Pause, a no-op if already paused), a toggle flips the one
+          before it and two toggles cancel out
+        """
+
+    def __init__(self, run):
+        # run(name, arg) carries out a command
+        self.run = run
+        # [name, arg, time queued]
+        self._queue = collections.deque()
+        self._source = None
+
+    def push(self, name, arg=None):
+        if self._queue and self._merge(name, arg):
+            STATS.count('command.merged')
+        else:
+            self._queue.append([name, arg, time.time()])
+        if self._source is None and self._queue:
+            self._source = glib.idle_add(self._on_idle)
+
+    def cancel(self):
+        if self._source is not None:
+            glib.source_remove(self._source)
+            self._source = None
+        self._queue.clear()
+
+    def _merge(self, name, arg):
+        last = self._queue[-1]
+        if last[0] != name:
+            return False
+        if name == 'skip':
+            last[1] += arg
+            if last[1] == 0:
+                self._queue.pop()
+        elif name == 'state':
+            if arg != 'Toggle':
+                last[1] = arg
+            elif last[1] == 'Toggle':
+                self._queue.pop()
+            else:
+                last[1] = 'Paused' if last[1] == 'Playing' else 'Playing'
+        else:
+            return False
+        return True
+
+    def _on_idle(self):
+        if not self._queue:
+            self._source = None
+            return False
+        # one command per iteration, the ones coming in meanwhile can
+        # still be merged
+        name, arg, queued = self._queue.popleft()
+        start = time.time()
+        STATS.record('command.%s.wait' % name, start - queued)
+        if TRACE.enabled:
+            TRACE.add('command', "%s %r" % (name, arg))
+        try:
+            self.run(name, arg)
+        except Exception:
+            logger.exception("Command %s(%r) failed", name, arg)
+        finally:
+            STATS.record('command.%s' % name, time.time() - start)
+        if self._queue:
+            return True
+        self._source = None
+        return False
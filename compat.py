@@ -0,0 +1,235 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import collections
+import glib
+import logging
+
+from xl import settings
+
+from stats import STATS
+
+logger = logging.getLogger(__name__)
+
+# events every supported Exaile version sends, and the Mpris2Manager
+# methods handling them
+COMMON_EVENTS = [
+    ('playback_track_start', 'on_playback_start'),
+    ('playback_player_start', 'on_playback_start'),
+    ('playback_track_end', 'on_playback_end'),
+    ('playback_player_pause', 'on_playback_pause'),
+    ('playback_toggle_pause', 'on_playback_pause'),
+    ('track_tags_changed', 'on_tags_update'),
+    ('option_set', 'on_option_change'),
+    ('playback_seeked', 'on_seek'),
+    ('cover_set', 'on_cover_change'),
+    ('cover_removed', 'on_cover_change'),
+]
+
+class SettingsBatch(object):
+    """ option writes, applied together when the main loop is idle
+
+        Writing an option may save the settings file; writes coming close
+        together are merged (the last value of each option wins) and
+        options left unchanged aren't written at all.
+        """
+
+    def __init__(self):
+        self._pending = collections.OrderedDict()
+        self._source = None
+
+    def get_option(self, option, default=None):
+        if option in self._pending:
+            return self._pending[option]
+        return settings.get_option(option, default)
+
+    def set_option(self, option, value):
+        if option in self._pending:
+            STATS.count('settings.merged')
+        self._pending[option] = value
+        if self._source is None:
+            self._source = glib.idle_add(self._on_idle)
+
+    def flush(self):
+        if self._source is not None:
+            glib.source_remove(self._source)
+            self._source = None
+        pending, self._pending = self._pending, collections.OrderedDict()
+        for option, value in pending.items():
+            if settings.get_option(option, None) != value:
+                settings.set_option(option, value)
+                STATS.count('settings.writes')
+
+    def _on_idle(self):
+        self._source = None
+        self.flush()
+        return False
+
+class LegacyPlaylistAccess(object):
+    """ repeat, shuffle and playlist handling of Exaile <= 0.3.2 """
+
+    name = '<= 0.3.2'
+
+    events = COMMON_EVENTS + [
+        ('tracks_reordered', 'on_playlist_reorder'),
+    ]
+
+    # option -> properties depending on it
+    options = {
+        'playback/repeat': ('LoopStatus', 'CanGoNext', 'CanGoPrevious'),
+        'playback/shuffle': ('Shuffle',),
+        'player/volume': ('Volume',),
+    }
+
+    def __init__(self):
+        self.settings = SettingsBatch()
+
+    def get_loop_status(self, playlist):
+        if playlist.repeat_enabled:
+            if playlist.repeat_mode == 'playlist':
+                return 'Playlist'
+            else:
+                return 'Track'
+        else:
+            return 'None'
+
+    def set_loop_status(self, playlist, value):
+        if value == 'Playlist':
+            enabled, mode = True, 'playlist'
+        elif value == 'Track':
+            enabled, mode = True, 'track'
+        else:
+            enabled, mode = False, 'none'
+        logger.debug("LoopStatus set: old, %r, %r", enabled, mode)
+        playlist.set_repeat(enabled, mode)
+        self.settings.set_option('playback/repeat', enabled)
+        if enabled:
+            self.settings.set_option('playback/repeat_mode', mode)
+
+    def get_shuffle(self, playlist):
+        return self.settings.get_option('playback/shuffle', False)
+
+    def set_shuffle(self, playlist, value):
+        logger.debug("Shuffle set: old, %r", value)
+        self.settings.set_option('playback/shuffle', bool(value))
+
+    def set_current_position(self, playlist, position):
+        playlist.set_current_pos(position)
+
+    def insert_tracks(self, playlist, position, tracks):
+        """ insert tracks at position, append them if it is None """
+        playlist.add_tracks(tracks, location=position)
+
+    def remove_track(self, playlist, position):
+        playlist.remove(position)
+
+    def get_queued(self, queue, count):
+        return list(queue.ordered_tracks[:count])
+
+class PlaylistAccess(object):
+    """ repeat, shuffle and playlist handling of Exaile >= 0.3.3 """
+
+    name = '>= 0.3.3'
+
+    events = COMMON_EVENTS + [
+        ('playlist_current_position_changed', 'on_playlist_change'),
+        ('playlist_tracks_added', 'on_playlist_tracks_added'),
+        ('playlist_tracks_removed', 'on_playlist_reorder'),
+        ('playlist_shuffle_mode_changed', 'on_shuffle_change'),
+        ('playlist_repeat_mode_changed', 'on_repeat_change'),
+    ]
+
+    options = {
+        'player/volume': ('Volume',),
+    }
+
+    def __init__(self):
+        # nothing goes through it on this version, the playlist keeps its
+        # own modes
+        self.settings = SettingsBatch()
+
+    def get_loop_status(self, playlist):
+        mode = playlist.get_repeat_mode()
+        if mode == 'disabled':
+            return 'None'
+        elif mode == 'all':
+            return 'Playlist'
+        else:
+            return 'Track'
+
+    def set_loop_status(self, playlist, value):
+        if value == 'Playlist':
+            mode = 'all'
+        elif value == 'Track':
+            mode = 'track'
+        else:
+            mode = 'disabled'
+        logger.debug("LoopStatus set: new, %r", mode)
+        playlist.set_repeat_mode(mode)
+
+    def get_shuffle(self, playlist):
+        return playlist.get_shuffle_mode() != 'disabled'
+
+    def set_shuffle(self, playlist, value):
+        logger.debug("Shuffle set: new, %r", value)
+        if value:
+            # TODO: This should toggle on/off like it did in 0.3.2, without
+            #       resetting the mode to 'track' if it was 'album' previously.
+            if self.get_shuffle(playlist):
+                # Ensure the current mode is kept for 'on' -> 'on' changes.
+                return
+            playlist.set_shuffle_mode('track')
+        else:
+            playlist.set_shuffle_mode('disabled')
+
+    def set_current_position(self, playlist, position):
+        playlist.current_position = position
+
+    def insert_tracks(self, playlist, position, tracks):
+        """ insert tracks at position, append them if it is None """
+        if position is None:
+            playlist.extend(tracks)
+        else:
+            playlist[position:position] = tracks
+
+    def remove_track(self, playlist, position):
+        del playlist[position]
+
+    def get_queued(self, queue, count):
+        return list(queue[:count])
+
+def detect_playlist_access(playlist):
+    """ the playlist access matching the running Exaile, probed once """
+    if hasattr(playlist, 'get_repeat_mode'):
+        access = PlaylistAccess()
+    else:
+        access = LegacyPlaylistAccess()
+    logger.info("Using playlist access for Exaile %s", access.name)
+    return access
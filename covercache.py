@@ -0,0 +1,385 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import base64
+import collections
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+INDEX_VERSION = 2
+
+THUMBNAIL_EXTENSIONS = {
+    'jpeg': '.jpg',
+    'png': '.png',
+}
+
+MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.gif': 'image/gif',
+}
+
+def _guess_extension(data):
+    if data.startswith(b'\x89PNG'):
+        return '.png'
+    elif data.startswith(b'\xff\xd8'):
+        return '.jpg'
+    elif data.startswith(b'GIF8'):
+        return '.gif'
+    return ''
+
+def make_data_uri(data):
+    """ data as a data: URI """
+    encoded = base64.b64encode(data)
+    if not isinstance(encoded, str):
+        encoded = encoded.decode('ascii')
+    return "data:%s;base64,%s" % (
+            MIME_TYPES.get(_guess_extension(data), 'application/octet-stream'),
+            encoded)
+
+def make_thumbnail(data, max_size, fmt):
+    """ data scaled down to fit in max_size x max_size and encoded as fmt
+        ('jpeg' or 'png'), None if it's fine as it is """
+    import gtk
+    loader = gtk.gdk.PixbufLoader()
+    loader.write(data)
+    loader.close()
+    pixbuf = loader.get_pixbuf()
+    width, height = pixbuf.get_width(), pixbuf.get_height()
+    if max(width, height) <= max_size:
+        if _guess_extension(data) == THUMBNAIL_EXTENSIONS[fmt]:
+            return None
+    else:
+        scale = float(max_size) / max(width, height)
+        pixbuf = pixbuf.scale_simple(max(1, int(width * scale)),
+                max(1, int(height * scale)), gtk.gdk.INTERP_BILINEAR)
+    chunks = []
+    options = {'quality': '90'} if fmt == 'jpeg' else {}
+    pixbuf.save_to_callback(lambda buf, *args: chunks.append(buf),
+            fmt, options)
+    return b''.join(chunks)
+
+class CoverCache(object):
+    """ content addressed cover files with a persistent track index
+
+        Every distinct image is stored once, named after the sha1 of its
+        data and scaled down to thumbnail_size (0 exports it untouched).
+        The index maps track locations to those hashes and keeps the files
+        in least recently used order, so that the cache can be held under
+        max_bytes and max_entries. It is thread safe, covers are stored
+        from worker threads.
+
+        Exported images of at most inline_max bytes aren't written at all,
+        they are kept in memory and exposed as data: URIs (those entries
+        aren't in the saved index).
+        """
+
+    def __init__(self, directory, max_bytes, max_entries,
+            thumbnail_size=0, thumbnail_format='jpeg', keep_original=False,
+            inline_max=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_format = thumbnail_format
+        self.keep_original = keep_original
+        self.inline_max = inline_max
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # held while the index is read, so that it's only read once
+        self._load_lock = threading.Lock()
+        # loc -> content hash
+        self._tracks = {}
+        # content hash -> (file names, total size), least recently used
+        # first; the first file is the exported one, the second the
+        # original cover if it is kept as well (no exported file, None,
+        # for covers kept inline)
+        self._files = collections.OrderedDict()
+        # content hash -> data: URI of the covers kept inline
+        self._inline = {}
+        # locs invalidated before the index was loaded
+        self._invalidated = set()
+        self._size = 0
+        self._dirty = False
+        self._loaded = False
+
+    def _get_params(self):
+        return [self.thumbnail_size, self.thumbnail_format, self.keep_original]
+
+    def ensure_loaded(self):
+        """ load the index unless it already was """
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self.load()
+
+    def load(self):
+        """ read the index, dropping entries whose files are gone and
+            files the index doesn't know about
+
+            The files are read without holding the lock, lookups don't
+            wait for them (they find nothing until the index is loaded).
+            """
+        tracks = {}
+        files = collections.OrderedDict()
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            pass
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                index = json.load(f)
+            if index.get('version') != INDEX_VERSION:
+                raise ValueError("unknown index version")
+            if index.get('params') != self._get_params():
+                raise ValueError("thumbnail settings changed")
+            for digest, names, size in index['files']:
+                if all(os.path.exists(os.path.join(self.directory, name))
+                        for name in names):
+                    files[digest] = (tuple(names), size)
+            for loc, digest in index['tracks'].items():
+                if digest in files:
+                    tracks[loc] = digest
+        except (IOError, OSError, ValueError, KeyError, TypeError) as ex:
+            logger.info("Starting with an empty cover cache: %r", ex)
+            tracks.clear()
+            files.clear()
+        self._remove_orphans(files)
+
+        with self._lock:
+            self._tracks = tracks
+            self._files = files
+            self._inline = {}
+            self._size = sum(size for names, size in files.values())
+            for loc in self._invalidated:
+                self._forget(loc)
+            self._invalidated.clear()
+            self._evict()
+            self._dirty = True
+            self._loaded = True
+
+    def save(self):
+        """ write the index if it changed """
+        with self._lock:
+            if not self._loaded or not self._dirty:
+                return
+            index = {
+                'version': INDEX_VERSION,
+                'params': self._get_params(),
+                'files': [[digest, names, size]
+                    for digest, (names, size) in self._files.items()
+                    if digest not in self._inline],
+                'tracks': dict((loc, digest)
+                    for loc, digest in self._tracks.items()
+                    if digest not in self._inline),
+            }
+            path = os.path.join(self.directory, INDEX_FILE)
+            try:
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(index, f)
+                os.rename(path + '.tmp', path)
+            except (IOError, OSError) as ex:
+                logger.error("Unable to save the cover cache index: %r", ex)
+                return
+            self._dirty = False
+
+    def cleanup(self):
+        """ enforce the limits, remove stray files and save the index """
+        with self._lock:
+            if not self._loaded:
+                return
+            self._evict()
+            self._remove_orphans(self._files)
+        self.save()
+
+    def lookup(self, loc, original=False):
+        """ url of the cover exported for loc (or of the original cover,
+            when it is kept), None if there is none or the index isn't
+            loaded yet """
+        if not self._loaded:
+            return None
+        with self._lock:
+            digest = self._tracks.get(loc)
+            if digest is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            names = self._touch(digest)
+            if original:
+                if len(names) < 2:
+                    return None
+                return self._get_url(names[1])
+            return self._get_url(names[0], digest)
+
+    def store(self, loc, data):
+        """ store the cover data of loc and return its url
+
+            Scaling the image is the expensive part, it is only done for
+            images the cache doesn't hold yet.
+            """
+        import hashlib
+        self.ensure_loaded()
+        digest = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            if digest in self._files:
+                return self._link(loc, digest)
+
+        files = []
+        thumbnail = None
+        if self.thumbnail_size > 0:
+            try:
+                thumbnail = make_thumbnail(data, self.thumbnail_size,
+                        self.thumbnail_format)
+            except Exception as ex:
+                logger.warning("Unable to scale cover, exporting it as is: %r",
+                        ex)
+        if thumbnail is not None:
+            files.append(("%s-%d%s" % (digest, self.thumbnail_size,
+                THUMBNAIL_EXTENSIONS[self.thumbnail_format]), thumbnail))
+        if thumbnail is None or self.keep_original:
+            files.append((digest + _guess_extension(data), data))
+
+        inline = None
+        if len(files[0][1]) <= self.inline_max:
+            inline = make_data_uri(files[0][1])
+            files[0] = (None, None)
+
+        size = 0 if inline is None else len(inline)
+        for name, content in files:
+            if name is None:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(content)
+                os.rename(path + '.tmp', path)
+            except (IOError, OSError) as ex:
+                logger.error("Unable to export cover: %r", ex)
+                return None
+            size += len(content)
+
+        with self._lock:
+            if digest not in self._files:
+                self._files[digest] = (tuple(name for name, content in files),
+                        size)
+                self._size += size
+                if inline is not None:
+                    self._inline[digest] = inline
+            return self._link(loc, digest)
+
+    def alias(self, loc, other_loc):
+        """ use the cover stored for other_loc for loc as well """
+        with self._lock:
+            digest = self._tracks.get(other_loc)
+            if digest is not None and digest in self._files:
+                self._tracks[loc] = digest
+                self._dirty = True
+
+    def invalidate(self, loc):
+        """ forget the cover stored for loc, and for the tracks sharing it
+            (the image itself goes when it is evicted) """
+        with self._lock:
+            if self._loaded:
+                self._forget(loc)
+            else:
+                self._invalidated.add(loc)
+
+    def _forget(self, loc):
+        digest = self._tracks.get(loc)
+        if digest is None:
+            return
+        for other, other_digest in list(self._tracks.items()):
+            if other_digest == digest:
+                del self._tracks[other]
+        self._dirty = True
+
+    def _link(self, loc, digest):
+        self._tracks[loc] = digest
+        self._dirty = True
+        names = self._touch(digest)
+        self._evict(keep=digest)
+        return self._get_url(names[0], digest)
+
+    def _get_url(self, name, digest=None):
+        if name is None:
+            return self._inline[digest]
+        return "file://%s" % os.path.join(self.directory, name)
+
+    def _touch(self, digest):
+        # mark as most recently used
+        entry = self._files.pop(digest)
+        self._files[digest] = entry
+        return entry[0]
+
+    def _evict(self, keep=None):
+        evicted = False
+        while self._files and (self._size > self.max_bytes
+                or len(self._files) > self.max_entries):
+            digest = next(iter(self._files))
+            if digest == keep:
+                break
+            names, size = self._files.pop(digest)
+            self._size -= size
+            self._inline.pop(digest, None)
+            for name in names:
+                if name is None:
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            evicted = True
+        if evicted:
+            self._dirty = True
+            for loc, digest in list(self._tracks.items()):
+                if digest not in self._files:
+                    del self._tracks[loc]
+
+    def _remove_orphans(self, files):
+        known = set([INDEX_FILE])
+        for names, size in files.values():
+            known.update(name for name in names if name is not None)
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name not in known:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
@@ -0,0 +1,174 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import dbus
+import dbus.lowlevel
+import dbus.service
+import logging
+
+from transport import Marshaller, Transport, split_signature
+
+logger = logging.getLogger(__name__)
+
+_BASIC_TYPES = {
+    'b': dbus.Boolean,
+    'y': dbus.Byte,
+    'n': dbus.Int16,
+    'q': dbus.UInt16,
+    'i': dbus.Int32,
+    'u': dbus.UInt32,
+    'x': dbus.Int64,
+    't': dbus.UInt64,
+    'd': dbus.Double,
+    's': dbus.String,
+    'o': dbus.ObjectPath,
+    'g': dbus.Signature,
+}
+
+class DBusPythonMarshaller(Marshaller):
+    """ dbus-python types carry their signature, variants need no wrapping """
+
+    def dict(self, signature, value):
+        return dbus.Dictionary(value, signature=signature[2:-1])
+
+    def array(self, signature, value):
+        return dbus.Array(value, signature=signature[1:])
+
+    def struct(self, signature, value):
+        return dbus.Struct(value, signature=signature[1:-1])
+
+    def basic(self, signature, value):
+        return _BASIC_TYPES[signature](value)
+
+class _ExportedObject(dbus.service.Object):
+    # every message goes straight to the transport, without the lookup of
+    # decorated methods done by dbus.service.Object
+    def __init__(self, transport, bus, object_path):
+        dbus.service.Object.__init__(self, bus, object_path)
+        self._transport = transport
+
+    def _message_cb(self, connection, message):
+        self._transport.on_message(connection, message)
+
+class DBusPythonTransport(Transport):
+    """ exports the adapter with dbus-python """
+
+    name = 'dbus-python'
+
+    def __init__(self, adapter):
+        Transport.__init__(self, adapter)
+        self.marshaller = DBusPythonMarshaller(adapter.variant_types)
+        self.bus = None
+        self.bus_name = None
+        self.object_path = None
+        self._object = None
+
+    def start(self, bus_name, object_path):
+        self.bus = dbus.SessionBus()
+        self.bus_name = bus_name
+        self.object_path = object_path
+        self._object = _ExportedObject(self, self.bus, object_path)
+        # don't wait for the bus daemon to answer
+        self.bus.call_async('org.freedesktop.DBus', '/org/freedesktop/DBus',
+                'org.freedesktop.DBus', 'RequestName', 'su', (bus_name, 0),
+                self._on_name_requested, self._on_name_error)
+
+    def stop(self):
+        if self._object is not None:
+            self._object.remove_from_connection()
+            self._object = None
+        if self.bus is not None:
+            self.bus.release_name(self.bus_name)
+            self.bus = None
+        self.marshaller.forget()
+
+    def _on_name_requested(self, result):
+        logger.debug("RequestName(%s): %d", self.bus_name, result)
+
+    def _on_name_error(self, error):
+        logger.error("Unable to claim %s: %s", self.bus_name, error)
+
+    def emit_signal(self, interface, name, args):
+        if self._object is None:
+            return
+        signature = self.interfaces[interface]['signals'][name]
+        message = dbus.lowlevel.SignalMessage(self.object_path, interface, name)
+        message.append(signature=signature,
+                *self.marshaller.convert_args(signature, args))
+        self.bus.send_message(message)
+
+    def watch_peer(self, name, vanished):
+        watch = self.bus.watch_name_owner(name,
+                lambda owner: owner or vanished())
+        return watch.cancel
+
+    def on_message(self, connection, message):
+        if not isinstance(message, dbus.lowlevel.MethodCallMessage):
+            return
+        interface = message.get_interface()
+        member = message.get_member()
+        signatures = self.get_signature(interface, member)
+        if signatures is None:
+            self._reply_error(connection, message,
+                    'org.freedesktop.DBus.Error.UnknownMethod',
+                    "%s.%s is not a method" % (interface, member))
+            return
+        out_signature = signatures[1]
+        args = message.get_args_list()
+        name = self.get_variant_name(member, args)
+
+        def reply(value):
+            if message.get_no_reply():
+                return
+            if not out_signature:
+                values = ()
+            elif len(split_signature(out_signature)) == 1:
+                values = (value,)
+            else:
+                values = value
+            try:
+                response = dbus.lowlevel.MethodReturnMessage(message)
+                response.append(signature=out_signature,
+                        *self.marshaller.convert_args(out_signature, values, name))
+            except Exception as ex:
+                logger.exception("Unable to reply to %s", member)
+                error(ex)
+                return
+            connection.send_message(response)
+
+        def error(exception):
+            if not message.get_no_reply():
+                self._reply_error(connection, message,
+                        self.error_name(exception), str(exception))
+
+        self.call(interface, member, args, message.get_sender(), reply, error)
+
+    def _reply_error(self, connection, message, name, text):
+        connection.send_message(dbus.lowlevel.ErrorMessage(message, name, text))
@@ -0,0 +1,153 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import itertools
+import logging
+import time
+
+from xl.player import QUEUE
+
+from stats import STATS, TRACE
+
+logger = logging.getLogger(__name__)
+
+# URIs whose tags are read by one worker job, and added to the playlist at
+# once
+CHUNK_SIZE = 50
+
+# where the tracks of a job go
+START = 'start'
+END = 'end'
+
+def read_tracks(uris):
+    """ the tracks of uris (directories and playlists are expanded), read
+        in a worker thread """
+    from xl import trax
+    start = time.time()
+    tracks = []
+    for uri in uris:
+        try:
+            tracks.extend(trax.get_tracks_from_uri(uri))
+        except Exception:
+            logger.warning("Unable to read %s", uri, exc_info=True)
+    STATS.record('enqueue.read', time.time() - start)
+    return tracks
+
+class EnqueueJob(object):
+
+    def __init__(self, job_id, uris, after, play):
+        self.id = job_id
+        self.total = len(uris)
+        self.chunks = [uris[i:i + CHUNK_SIZE]
+                for i in range(0, len(uris), CHUNK_SIZE)]
+        # chunk index -> tracks read, until they are inserted in order
+        self.ready = {}
+        self.next_chunk = 0
+        self.done = 0
+        self.added = 0
+        # START, END, or the track the next chunk is inserted after
+        self.after = after
+        self.play = play
+
+class Enqueuer(object):
+    """ adds URIs to the current playlist without blocking the main loop
+
+        Tags are read by the worker pool, a chunk at a time, and the chunks
+        are inserted in order as they come back. The adapter reports the
+        progress of each job.
+        """
+
+    def __init__(self, adapter, pool):
+        self.adapter = adapter
+        self.pool = pool
+        self._ids = itertools.count(1)
+        self._jobs = {}
+
+    def enqueue(self, uris, after=END, play=False):
+        """ queue uris to be inserted after the track after (or at START or
+            END of the playlist), returns the job id """
+        job = EnqueueJob(next(self._ids), list(uris), after, play)
+        if TRACE.enabled:
+            TRACE.add('enqueue', "job %d: %d uris" % (job.id, job.total))
+        if not job.chunks:
+            self.adapter.EnqueueFinished(job.id, 0)
+            return job.id
+        self._jobs[job.id] = job
+        for index, chunk in enumerate(job.chunks):
+            self.pool.submit(read_tracks, (chunk,),
+                    lambda tracks, job=job, index=index:
+                        self._on_chunk_read(job, index, tracks),
+                    # a chunk that couldn't be read adds nothing, the
+                    # next ones are still inserted
+                    lambda ex, job=job, index=index:
+                        self._on_chunk_read(job, index, []))
+        return job.id
+
+    def cancel(self):
+        self._jobs.clear()
+
+    def _on_chunk_read(self, job, index, tracks):
+        if self._jobs.get(job.id) is not job:
+            return
+        job.ready[index] = tracks
+        while job.next_chunk in job.ready:
+            chunk = job.next_chunk
+            self._insert(job, job.ready.pop(chunk))
+            job.done += len(job.chunks[chunk])
+            job.next_chunk += 1
+            self.adapter.EnqueueProgress(job.id, job.done, job.total)
+        if job.next_chunk == len(job.chunks):
+            del self._jobs[job.id]
+            self.adapter.EnqueueFinished(job.id, job.added)
+
+    def _insert(self, job, tracks):
+        if not tracks:
+            return
+        start = time.time()
+        playlist = QUEUE.current_playlist
+        if job.after is END:
+            position = None
+        elif job.after is START:
+            position = 0
+        else:
+            try:
+                position = self.adapter._get_position(job.after) + 1
+            except ValueError:
+                # the track went away meanwhile
+                position = None
+        self.adapter.playlist_access.insert_tracks(playlist, position, tracks)
+        job.after = tracks[-1]
+        job.added += len(tracks)
+        STATS.record('enqueue.insert', time.time() - start)
+        if job.play:
+            job.play = False
+            self.adapter.playlist_access.set_current_position(playlist,
+                    self.adapter._get_position(tracks[0]))
+            QUEUE.play(track=tracks[0])
@@ -0,0 +1,214 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import glob
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+# until (or unless) GStreamer tells otherwise
+DEFAULT_MIME_TYPES = [
+    'audio/mpeg',
+    'audio/ogg',
+    'audio/vorbis',
+]
+DEFAULT_URI_SCHEMES = ['file', 'http', 'https']
+
+# caps of containers and streams -> the MIME types of their files
+CAPS_MIME_TYPES = {
+    'application/ogg': ['audio/ogg', 'application/ogg'],
+    'application/x-ogg': ['audio/ogg'],
+    'audio/x-flac': ['audio/flac', 'audio/x-flac'],
+    'audio/x-vorbis': ['audio/vorbis'],
+    'audio/x-opus': ['audio/opus'],
+    'audio/x-speex': ['audio/x-speex'],
+    'audio/x-m4a': ['audio/mp4', 'audio/x-m4a'],
+    'video/quicktime': ['audio/mp4', 'audio/x-m4a'],
+    'audio/x-wav': ['audio/x-wav', 'audio/wav'],
+    'audio/x-ms-wma': ['audio/x-ms-wma'],
+    'video/x-ms-asf': ['audio/x-ms-wma'],
+    'application/x-ape': ['audio/x-ape'],
+    'audio/x-wavpack': ['audio/x-wavpack'],
+    'audio/x-musepack': ['audio/x-musepack'],
+}
+
+def _get_gst():
+    """ (GStreamer bindings, their API version), (None, None) if neither
+        the ones loaded by Exaile nor gi's can be imported """
+    if _static_bindings():
+        try:
+            import gst
+            return gst, '0.10'
+        except ImportError:
+            if 'glib' in sys.modules:
+                # gi can't be loaded next to the static bindings
+                return None, None
+    try:
+        from gi.repository import Gst
+    except ImportError:
+        return None, None
+    if not Gst.is_initialized():
+        Gst.init(None)
+    return Gst, '1.0'
+
+def _static_bindings():
+    # whether PyGTK's static bindings (or none yet) are loaded, rather
+    # than gi's
+    glib_module = sys.modules.get('glib')
+    return glib_module is None or glib_module.__name__ == 'glib'
+
+def _get_registry_stamp(gst, api):
+    """ the version and modification time of the registry, None if its
+        file can't be found """
+    if api == '0.10':
+        path = os.environ.get('GST_REGISTRY')
+        directory = os.path.expanduser('~/.gstreamer-0.10')
+    else:
+        path = os.environ.get('GST_REGISTRY_1_0')
+        directory = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                os.path.expanduser('~/.cache'), 'gstreamer-1.0')
+    paths = [path] if path else glob.glob(os.path.join(directory, 'registry.*.bin'))
+    try:
+        mtime = max(os.stat(p).st_mtime for p in paths)
+    except (OSError, ValueError):
+        return None
+    return [gst.version_string(), mtime]
+
+def _scan_gst(gst, api):
+    """ (sink caps of decoders and demuxers, protocols of sources) """
+    caps_names = set()
+    protocols = set()
+    if api == '0.10':
+        registry = gst.registry_get_default()
+        factories = registry.get_feature_list(gst.ElementFactory)
+        sink, uri_src = gst.PAD_SINK, gst.URI_SRC
+        get_klass = lambda factory: factory.get_klass()
+    else:
+        registry = gst.Registry.get()
+        factories = registry.get_feature_list(gst.ElementFactory)
+        sink, uri_src = gst.PadDirection.SINK, gst.URIType.SRC
+        get_klass = lambda factory: factory.get_metadata('klass') or ''
+    for factory in factories:
+        klass = get_klass(factory)
+        if 'Decoder' in klass or 'Demux' in klass:
+            for template in factory.get_static_pad_templates():
+                if template.direction != sink:
+                    continue
+                caps = template.get_caps()
+                for i in range(caps.get_size()):
+                    caps_names.add(caps.get_structure(i).get_name())
+        if factory.get_uri_type() == uri_src:
+            protocols.update(factory.get_uri_protocols() or ())
+    return caps_names, protocols
+
+def _get_gio_schemes():
+    try:
+        if _static_bindings():
+            import gio
+            return gio.vfs_get_default().get_supported_uri_schemes()
+        from gi.repository import Gio
+        return Gio.Vfs.get_default().get_supported_uri_schemes()
+    except ImportError:
+        return []
+
+def caps_to_mime_types(caps_names):
+    mime_types = set()
+    for name in caps_names:
+        if name in CAPS_MIME_TYPES:
+            mime_types.update(CAPS_MIME_TYPES[name])
+        elif name.startswith('audio/') and not name.startswith('audio/x-raw'):
+            mime_types.add(name)
+    return sorted(mime_types)
+
+class SupportedFormats(object):
+    """ the MIME types and URI schemes Exaile can play
+
+        Found by going through the GStreamer registry (and GIO), which is
+        slow, so the result is kept on disk along with the stamp of the
+        registry and only looked for again when that changes.
+        """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.mime_types = DEFAULT_MIME_TYPES
+        self.uri_schemes = DEFAULT_URI_SCHEMES
+
+    def discover(self):
+        """ (mime types, uri schemes), from the cache when the registry
+            didn't change; runs in a worker thread """
+        gst, api = _get_gst()
+        if gst is None:
+            logger.info("GStreamer isn't available, using the default formats")
+            return None
+        stamp = _get_registry_stamp(gst, api)
+        if stamp is not None:
+            cached = self._load(stamp)
+            if cached is not None:
+                return cached
+        caps_names, protocols = _scan_gst(gst, api)
+        mime_types = caps_to_mime_types(caps_names)
+        schemes = sorted(set(protocols).union(_get_gio_schemes(), ['file']))
+        if stamp is not None:
+            self._save(stamp, mime_types, schemes)
+        return mime_types, schemes
+
+    def set(self, formats):
+        if formats:
+            self.mime_types, self.uri_schemes = formats
+
+    def _load(self, stamp):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            if cache.get('version') != CACHE_VERSION or \
+                    cache.get('stamp') != stamp:
+                return None
+            return cache['mime_types'], cache['uri_schemes']
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def _save(self, stamp, mime_types, schemes):
+        cache = {
+            'version': CACHE_VERSION,
+            'stamp': stamp,
+            'mime_types': mime_types,
+            'uri_schemes': schemes,
+        }
+        try:
+            with open(self.cache_path + '.tmp', 'w') as f:
+                json.dump(cache, f)
+            os.rename(self.cache_path + '.tmp', self.cache_path)
+        except (IOError, OSError) as ex:
+            logger.warning("Unable to save the supported formats: %r", ex)
@@ -0,0 +1,166 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import logging
+import time
+
+from gi.repository import Gio, GLib
+
+from stats import STATS
+from transport import Marshaller, Transport, split_signature
+
+logger = logging.getLogger(__name__)
+
+class GDBusMarshaller(Marshaller):
+    """ GLib.Variant takes plain values, only variants are wrapped """
+
+    def variant(self, signature, value):
+        return GLib.Variant(signature, value)
+
+class GDBusTransport(Transport):
+    """ exports the adapter with GDBus
+
+        The vtable is built from the adapter's introspection data and
+        properties are served through GDBus' own Properties handling. The
+        bus connection and the name are acquired asynchronously.
+        """
+
+    name = 'gdbus'
+
+    def __init__(self, adapter):
+        Transport.__init__(self, adapter)
+        self.marshaller = GDBusMarshaller(adapter.variant_types)
+        self.node_info = Gio.DBusNodeInfo.new_for_xml(adapter.introspection)
+        self.connection = None
+        self.object_path = None
+        self._owner_id = None
+        self._registrations = []
+
+    def start(self, bus_name, object_path):
+        self.object_path = object_path
+        self._owner_id = Gio.bus_own_name(Gio.BusType.SESSION, bus_name,
+                Gio.BusNameOwnerFlags.NONE, self._on_bus_acquired,
+                self._on_name_acquired, self._on_name_lost)
+
+    def stop(self):
+        if self.connection is not None:
+            for registration in self._registrations:
+                self.connection.unregister_object(registration)
+            self.connection = None
+        self._registrations = []
+        if self._owner_id is not None:
+            Gio.bus_unown_name(self._owner_id)
+            self._owner_id = None
+        self.marshaller.forget()
+
+    def _on_bus_acquired(self, connection, bus_name):
+        self.connection = connection
+        for interface_info in self.node_info.interfaces:
+            if interface_info.name.startswith('org.freedesktop.DBus.'):
+                # GDBus implements these itself
+                continue
+            self._registrations.append(connection.register_object(
+                self.object_path, interface_info, self._on_method_call,
+                self._on_get_property, self._on_set_property))
+
+    def _on_name_acquired(self, connection, bus_name):
+        logger.debug("Acquired %s", bus_name)
+
+    def _on_name_lost(self, connection, bus_name):
+        logger.warning("Lost (or unable to claim) %s", bus_name)
+
+    def emit_signal(self, interface, name, args):
+        if self.connection is None:
+            return
+        signature = self.interfaces[interface]['signals'][name]
+        self.connection.emit_signal(None, self.object_path, interface, name,
+                GLib.Variant('(%s)' % signature,
+                    self.marshaller.convert_args(signature, args)))
+
+    def watch_peer(self, name, vanished):
+        watch_id = Gio.bus_watch_name_on_connection(self.connection, name,
+                Gio.BusNameWatcherFlags.NONE, None,
+                lambda connection, name: vanished())
+        return lambda: Gio.bus_unwatch_name(watch_id)
+
+    def _on_method_call(self, connection, sender, object_path, interface,
+            member, parameters, invocation):
+        signatures = self.get_signature(interface, member)
+        if signatures is None:
+            invocation.return_dbus_error(
+                    'org.freedesktop.DBus.Error.UnknownMethod',
+                    "%s.%s is not a method" % (interface, member))
+            return
+        out_signature = signatures[1]
+        args = parameters.unpack()
+
+        def reply(value):
+            if not out_signature:
+                values = ()
+            elif len(split_signature(out_signature)) == 1:
+                values = (value,)
+            else:
+                values = value
+            try:
+                result = GLib.Variant('(%s)' % out_signature,
+                        self.marshaller.convert_args(out_signature, values))
+            except Exception as ex:
+                logger.exception("Unable to reply to %s", member)
+                error(ex)
+                return
+            invocation.return_value(result)
+
+        def error(exception):
+            invocation.return_dbus_error(self.error_name(exception),
+                    str(exception))
+
+        self.call(interface, member, args, sender, reply, error)
+
+    def _on_get_property(self, connection, sender, object_path, interface,
+            prop):
+        start = time.time()
+        self.adapter.listeners.seen(sender)
+        try:
+            value = self.adapter.Get(interface, prop)
+            signature = self.interfaces[interface]['properties'][prop][0]
+            return GLib.Variant(signature,
+                    self.marshaller.convert(signature, value, prop))
+        finally:
+            STATS.record('dbus.Get', time.time() - start)
+
+    def _on_set_property(self, connection, sender, object_path, interface,
+            prop, value):
+        start = time.time()
+        self.adapter.listeners.seen(sender)
+        try:
+            self.adapter.Set(interface, prop, value.unpack())
+            return True
+        finally:
+            STATS.record('dbus.Set', time.time() - start)
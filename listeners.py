@@ -0,0 +1,84 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import logging
+
+from stats import STATS, TRACE
+
+logger = logging.getLogger(__name__)
+
+class Listeners(object):
+    """ the peers that called into the plugin and are still on the bus
+
+        Clients of the sound menu kind fetch the properties before they
+        start listening to their changes, so the peers that never called
+        are taken as not listening. on_change(active) is called when the
+        first peer shows up and when the last one leaves.
+        """
+
+    def __init__(self, on_change):
+        self.on_change = on_change
+        # watch(name, vanished) -> cancel(), set by the transport
+        self.watch = None
+        # peer name -> cancels its watch
+        self._peers = {}
+
+    def __len__(self):
+        return len(self._peers)
+
+    def seen(self, name):
+        """ name called a method or read a property """
+        if not name or name in self._peers or self.watch is None:
+            return
+        self._peers[name] = self.watch(name, lambda: self.vanished(name))
+        STATS.count('listeners.appeared')
+        if TRACE.enabled:
+            TRACE.add('listener', "%s appeared" % name)
+        if len(self._peers) == 1:
+            logger.debug("First listener: %s", name)
+            self.on_change(True)
+
+    def vanished(self, name):
+        cancel = self._peers.pop(name, None)
+        if cancel is None:
+            return
+        cancel()
+        STATS.count('listeners.vanished')
+        if TRACE.enabled:
+            TRACE.add('listener', "%s vanished" % name)
+        if not self._peers:
+            logger.debug("No listeners left")
+            self.on_change(False)
+
+    def clear(self):
+        """ stop watching every peer, without calling on_change """
+        for cancel in self._peers.values():
+            cancel()
+        self._peers.clear()
@@ -27,24 +27,115 @@
 # from your version.
 #
 
-import dbus
-import hashlib
+import collections
+import glib
+import itertools
 import logging
 import time
 import os
+import weakref
 
 from xl import event, settings, xdg
 from xl.player import PLAYER, QUEUE
-from xl.covers import MANAGER as cover_manager
+
+from commands import CommandQueue
+from covercache import CoverCache
+from enqueue import END, START, Enqueuer
+from formats import SupportedFormats
+from listeners import Listeners
+from position import PositionClock
+from prefetch import Prefetcher
+from stats import STATS, TRACE
+from throttle import Throttle
+from transport import parse_introspection
+from tracklist import NO_TRACK, TrackListWindow
+from workers import WorkerPool
 
 logger = logging.getLogger(__name__)
 
 NANOSECOND = 1/0.000000001
 MICROSECOND = 1/0.000001
 
+# delay (in ms) used to merge property changes into a single
+# PropertiesChanged signal, 0 means "at the next main loop iteration"
+EMIT_DELAY_OPTION = 'plugin/soundmenu/emit_delay'
+
+# number of tracks whose metadata is kept around
+METADATA_CACHE_SIZE = 64
+
+# exported covers live in this subdirectory of the Exaile cache directory
+# (or of $XDG_RUNTIME_DIR)
+COVER_CACHE_DIR = 'soundmenu-covers'
+
+# file in the cache directory keeping the formats found in GStreamer
+FORMATS_CACHE = 'soundmenu-formats.json'
+# limits of the cover cache, in megabytes and number of distinct covers
+COVER_CACHE_SIZE_OPTION = 'plugin/soundmenu/cover_cache_size'
+COVER_CACHE_ENTRIES_OPTION = 'plugin/soundmenu/cover_cache_entries'
+# exported covers are scaled down to fit in a square of this size (0 keeps
+# them as they are) and re-encoded as 'jpeg' or 'png'
+COVER_SIZE_OPTION = 'plugin/soundmenu/cover_size'
+COVER_FORMAT_OPTION = 'plugin/soundmenu/cover_format'
+# also keep the original cover, exposed as exaile:artUrlOriginal
+COVER_ORIGINAL_OPTION = 'plugin/soundmenu/cover_original'
+# where covers are exported: 'cache' (the Exaile cache directory),
+# 'runtime' ($XDG_RUNTIME_DIR, usually a tmpfs, lost on logout) or 'data'
+# (covers of at most cover_inline_max kilobytes go straight into artUrl as
+# data: URIs, larger ones to $XDG_RUNTIME_DIR)
+COVER_EXPORT_OPTION = 'plugin/soundmenu/cover_export'
+COVER_INLINE_MAX_OPTION = 'plugin/soundmenu/cover_inline_max'
+
+# number of upcoming tracks whose metadata and cover are prepared ahead
+PREFETCH_OPTION = 'plugin/soundmenu/prefetch_count'
+
+# number of tracks around the current one exposed through TrackList
+TRACKLIST_SIZE_OPTION = 'plugin/soundmenu/tracklist_size'
+
+# while playing, the position is read from the player every that many
+# seconds (in between it is extrapolated), and Seeked is emitted when it
+# drifted by more than POSITION_DRIFT seconds
+POSITION_RESYNC_OPTION = 'plugin/soundmenu/position_resync'
+POSITION_DRIFT = 0.5
+
+# seeks requested over D-Bus, and Seeked signals, are merged into at most
+# one per that many milliseconds (the last one wins), 0 disables it
+SEEK_INTERVAL_OPTION = 'plugin/soundmenu/seek_interval'
+
+# log the hot path statistics every that many seconds, 0 disables it
+STATS_INTERVAL_OPTION = 'plugin/soundmenu/stats_interval'
+
+# keep a trace of recent events and emissions (see GetTrace), can also be
+# turned on at runtime with SetTrace
+TRACE_OPTION = 'plugin/soundmenu/trace'
+
+# skip the signals (and the work of building them) while no client that
+# called into the plugin is still connected
+LISTENER_AWARE_OPTION = 'plugin/soundmenu/listener_aware'
+
+# writes to a property closer together than that many milliseconds are
+# merged (the last one wins), and their echoes aren't signalled until the
+# writes stop
+WRITE_INTERVAL_OPTION = 'plugin/soundmenu/write_interval'
+
+# threads used to fetch and export covers
+COVER_THREADS = 2
+
+# threads reading the tags of enqueued URIs
+TAG_THREADS = 2
+
+# Player properties depending on the current playlist
+PLAYLIST_PROPERTIES = ('LoopStatus', 'Shuffle', 'CanPlay', 'CanGoNext',
+        'CanGoPrevious')
+
+# marks a queued property whose value has to be computed when emitting
+_COMPUTE = object()
+
+ORG_FREEDESKTOP_DBUS_PROPERTIES = "org.freedesktop.DBus.Properties"
 ORG_MPRIS_MEDIAPLAYER2 = "org.mpris.MediaPlayer2"
 ORG_MPRIS_MEDIAPLAYER2_PLAYER = "org.mpris.MediaPlayer2.Player"
 ORG_MPRIS_MEDIAPLAYER2_TRACKLIST = "org.mpris.MediaPlayer2.TrackList"
+ORG_EXAILE_MPRIS2 = "org.exaile.Mpris2"
+ORG_EXAILE_MPRIS2_DEBUG = "org.exaile.Mpris2.Debug"
 
 MPRIS2_INTROSPECTION = \
 """<node name="/org/mpris/MediaPlayer2">
@@ -152,98 +243,565 @@ MPRIS2_INTROSPECTION = \
             <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal" value="false"/>
         </property>
     </interface>
+    <interface name="org.mpris.MediaPlayer2.TrackList">
+        <method name="GetTracksMetadata">
+            <arg direction="in" name="TrackIds" type="ao"/>
+            <arg direction="out" name="Metadata" type="aa{sv}"/>
+        </method>
+        <method name="AddTrack">
+            <arg direction="in" name="Uri" type="s"/>
+            <arg direction="in" name="AfterTrack" type="o"/>
+            <arg direction="in" name="SetAsCurrent" type="b"/>
+        </method>
+        <method name="RemoveTrack">
+            <arg direction="in" name="TrackId" type="o"/>
+        </method>
+        <method name="GoTo">
+            <arg direction="in" name="TrackId" type="o"/>
+        </method>
+        <signal name="TrackListReplaced">
+            <arg name="Tracks" type="ao"/>
+            <arg name="CurrentTrack" type="o"/>
+        </signal>
+        <signal name="TrackAdded">
+            <arg name="Metadata" type="a{sv}"/>
+            <arg name="AfterTrack" type="o"/>
+        </signal>
+        <signal name="TrackRemoved">
+            <arg name="TrackId" type="o"/>
+        </signal>
+        <signal name="TrackMetadataChanged">
+            <arg name="TrackId" type="o"/>
+            <arg name="Metadata" type="a{sv}"/>
+        </signal>
+        <property name="Tracks" type="ao" access="read">
+            <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal" value="invalidates"/>
+        </property>
+        <property name="CanEditTracks" type="b" access="read">
+            <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal" value="true"/>
+        </property>
+    </interface>
+    <interface name="org.exaile.Mpris2">
+        <method name="EnqueueUris">
+            <arg direction="in" name="uris" type="as"/>
+            <arg direction="in" name="play" type="b"/>
+            <arg direction="out" name="job" type="u"/>
+        </method>
+        <signal name="EnqueueProgress">
+            <arg name="job" type="u"/>
+            <arg name="done" type="u"/>
+            <arg name="total" type="u"/>
+        </signal>
+        <signal name="EnqueueFinished">
+            <arg name="job" type="u"/>
+            <arg name="added" type="u"/>
+        </signal>
+    </interface>
+    <interface name="org.exaile.Mpris2.Debug">
+        <method name="GetStats">
+            <arg direction="out" name="stats" type="a{sa{sd}}"/>
+        </method>
+        <method name="ResetStats"/>
+        <method name="SetTrace">
+            <arg direction="in" name="enabled" type="b"/>
+        </method>
+        <method name="GetTrace">
+            <arg direction="out" name="events" type="a(dss)"/>
+        </method>
+    </interface>
 </node>"""
 
-class Mpris2Adapter(dbus.service.Object):
-    """ interface defined by org.mpris.MediaPlayer2"""
-
-    _properties = [
-        # application
-        "CanQuit",
-        "CanRaise",
-        "DesktopEntry",
-        "HasTrackList",
-        "Identity",
-        "SupportedMimeTypes",
-        "SupportedUriSchemes",
-        # player
-        "CanControl",
-        "CanGoNext",
-        "CanGoPrevious",
-        "CanPause",
-        "CanPlay",
-        "CanSeek",
-        "LoopStatus",
-        "MaximumRate",
-        "MinimumRate",
-        "Metadata",
-        "PlaybackStatus",
-        "Position",
-        "Rate",
-        "Shuffle",
-        "Volume",
-    ]
-
-    def __init__(self, exaile, bus):
-#        super(Mpris2Adapter, self).__init__(self, bus, unicode('/org/mpris/MediaPlayer2'))
-        dbus.service.Object.__init__(self, bus, '/org/mpris/MediaPlayer2')
+# D-Bus types of the metadata entries, the others are guessed from their value
+METADATA_TYPES = {
+    'mpris:trackid': 'o',
+    'mpris:length': 'x',
+    'mpris:artUrl': 's',
+    'xesam:url': 's',
+    'xesam:title': 's',
+    'xesam:artist': 'as',
+    'xesam:album': 's',
+    'xesam:genre': 'as',
+    'xesam:userRating': 'd',
+}
+
+def _get_variant_types():
+    types = dict(METADATA_TYPES)
+    for interface in parse_introspection(MPRIS2_INTROSPECTION).values():
+        for prop, (signature, access) in interface['properties'].items():
+            types[prop] = signature
+    return types
+
+def _get_cover_root(cover_export):
+    """ directory the covers are exported under, for cover_export """
+    if cover_export in ('runtime', 'data'):
+        runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+        if runtime_dir and os.path.isdir(runtime_dir):
+            return runtime_dir
+        logger.warning("$XDG_RUNTIME_DIR isn't set, exporting covers to "
+                "the cache directory")
+    elif cover_export != 'cache':
+        logger.warning("Unknown cover export %r, using the cache directory",
+                cover_export)
+    return xdg.get_cache_dir()
+
+def _get_writable_properties():
+    writable = set()
+    for name, interface in parse_introspection(MPRIS2_INTROSPECTION).items():
+        for prop, (signature, access) in interface['properties'].items():
+            if access == 'readwrite':
+                writable.add((name, prop))
+    return frozenset(writable)
+
+class UnknownProperty(ValueError):
+    """ Get or Set on a property the interface doesn't have """
+    _dbus_error_name = 'org.freedesktop.DBus.Error.UnknownProperty'
+
+class PropertyReadOnly(ValueError):
+    """ Set on a property that can only be read """
+    _dbus_error_name = 'org.freedesktop.DBus.Error.PropertyReadOnly'
+
+class PlaylistIndex(object):
+    """ track -> position map for the current playlist, so that position
+        lookups don't need to scan the whole playlist every time """
+
+    def __init__(self):
+        self.playlist = None
+        self.length = 0
+        self.positions = None
+
+    def invalidate(self):
+        self.positions = None
+
+    def index(self, playlist, track):
+        """ same contract as playlist.index(track) """
+        if self.positions is None or playlist is not self.playlist \
+                or len(playlist) != self.length:
+            self._rebuild(playlist)
+        try:
+            idx = self.positions[track]
+        except KeyError:
+            raise ValueError("track not in playlist")
+        try:
+            if playlist[idx] is track:
+                return idx
+        except IndexError:
+            pass
+        # the playlist changed without telling us, fall back to a scan
+        self._rebuild(playlist)
+        try:
+            return self.positions[track]
+        except KeyError:
+            raise ValueError("track not in playlist")
+
+    def tracks_added(self, playlist, added):
+        """ patch the index for tracks appended at the end of the playlist,
+            anything else invalidates it """
+        if self.positions is None or playlist is not self.playlist:
+            return
+        try:
+            for idx, track in added:
+                if idx != self.length:
+                    self.invalidate()
+                    return
+                self.positions.setdefault(track, idx)
+                self.length += 1
+        except (TypeError, ValueError):
+            self.invalidate()
+
+    def _rebuild(self, playlist):
+        start = time.time()
+        positions = {}
+        for idx, track in enumerate(playlist):
+            # keep the first occurrence, like list.index() does
+            positions.setdefault(track, idx)
+        self.playlist = playlist
+        self.length = len(playlist)
+        self.positions = positions
+        STATS.record('playlist_index.rebuild', time.time() - start)
+
+class TrackIds(object):
+    """ stable object paths for tracks
+
+        A track gets its path the first time it is asked for and keeps it
+        for as long as it lives, whatever happens to the playlist.
+        """
+
+    PREFIX = '/org/exaile/Exaile/Track'
+
+    def __init__(self):
+        self._counter = itertools.count(1)
+        self._paths = weakref.WeakKeyDictionary()
+        self._tracks = weakref.WeakValueDictionary()
+
+    def get_path(self, track):
+        try:
+            return self._paths[track]
+        except KeyError:
+            path = "%s%d" % (self.PREFIX, next(self._counter))
+            self._paths[track] = path
+            self._tracks[path] = track
+            return path
+
+    def get_track(self, path):
+        """ the track path was given to, None if it's unknown or gone """
+        return self._tracks.get(path)
+
+class Mpris2Adapter(object):
+    """ interface defined by org.mpris.MediaPlayer2
+
+        Only deals with plain python values, it is exported on the bus by
+        a transport (see transport.py).
+        """
+
+    introspection = MPRIS2_INTROSPECTION
+
+    # D-Bus types of the values sent as variants, by property or key name
+    variant_types = _get_variant_types()
+
+    # methods answering through reply_handler/error_handler
+    async_methods = frozenset(["GetTracksMetadata"])
+
+    _properties = {
+        ORG_MPRIS_MEDIAPLAYER2: [
+            "CanQuit",
+            "CanRaise",
+            "DesktopEntry",
+            "HasTrackList",
+            "Identity",
+            "SupportedMimeTypes",
+            "SupportedUriSchemes",
+        ],
+        ORG_MPRIS_MEDIAPLAYER2_PLAYER: [
+            "CanControl",
+            "CanGoNext",
+            "CanGoPrevious",
+            "CanPause",
+            "CanPlay",
+            "CanSeek",
+            "LoopStatus",
+            "MaximumRate",
+            "MinimumRate",
+            "Metadata",
+            "PlaybackStatus",
+            "Position",
+            "Rate",
+            "Shuffle",
+            "Volume",
+        ],
+        ORG_MPRIS_MEDIAPLAYER2_TRACKLIST: [
+            "CanEditTracks",
+            "Tracks",
+        ],
+    }
+
+    # (interface, property) pairs Set accepts
+    _writable_properties = _get_writable_properties()
+
+    # properties changing without any event, never kept in snapshots
+    _volatile_properties = frozenset(["Position"])
+
+    def __init__(self, exaile, playlist_access):
         self.exaile = exaile
-
-        self.cover_cache = {}
+        # set by the transport exporting the adapter
+        self.transport = None
+        self.listeners = Listeners(self._on_listeners_changed)
+        self._listener_aware = settings.get_option(LISTENER_AWARE_OPTION, True)
+        # repeat/shuffle/playlist handling for the running Exaile version
+        self.playlist_access = playlist_access
+
+        cover_export = settings.get_option(COVER_EXPORT_OPTION, 'cache')
+        self.cover_cache = CoverCache(
+                os.path.join(_get_cover_root(cover_export), COVER_CACHE_DIR),
+                settings.get_option(COVER_CACHE_SIZE_OPTION, 50) * 1024 * 1024,
+                settings.get_option(COVER_CACHE_ENTRIES_OPTION, 1000),
+                settings.get_option(COVER_SIZE_OPTION, 256),
+                settings.get_option(COVER_FORMAT_OPTION, 'jpeg'),
+                settings.get_option(COVER_ORIGINAL_OPTION, False),
+                settings.get_option(COVER_INLINE_MAX_OPTION, 24) * 1024
+                    if cover_export == 'data' else 0)
+        # __loc of tracks known to have no cover
+        self._no_cover = set()
+        self._covers_in_flight = {}
+        self._cover_pool = WorkerPool('soundmenu-covers', COVER_THREADS)
+        self.prefetcher = Prefetcher(self, settings.get_option(PREFETCH_OPTION, 3))
+        self.tracklist = TrackListWindow(self,
+                settings.get_option(TRACKLIST_SIZE_OPTION, 30))
+        self.playlist_index = PlaylistIndex()
+        self.track_ids = TrackIds()
+        self.commands = CommandQueue(self._run_command)
+        self._tag_pool = WorkerPool('soundmenu-tags', TAG_THREADS)
+        self.enqueuer = Enqueuer(self, self._tag_pool)
+        self.formats = SupportedFormats(
+                os.path.join(xdg.get_cache_dir(), FORMATS_CACHE))
+        self.position = PositionClock(PLAYER,
+                settings.get_option(POSITION_RESYNC_OPTION, 5), POSITION_DRIFT,
+                lambda pos: self.seeked(pos / NANOSECOND * MICROSECOND))
+        seek_interval = settings.get_option(SEEK_INTERVAL_OPTION, 150)
+        self._seek_throttle = Throttle(seek_interval, self._do_seek)
+        self._seeked_throttle = Throttle(seek_interval, self._emit_seeked)
+        # property -> Throttle of its writes
+        self._writers = {}
+        self._write_interval = settings.get_option(WRITE_INTERVAL_OPTION, 100)
+
+        self._pending = {}
+        self._flush_source = None
+        # last value sent for each property, per interface
+        self._emitted = {}
+        self.emit_stats = {'emitted': 0, 'suppressed': 0, 'seeked': 0}
+
+        # track -> metadata, least recently used first
+        self._metadata_cache = collections.OrderedDict()
+
+        # interface -> property values, replaced (never modified) when
+        # some of its properties are marked stale
+        self._snapshots = {}
+        self._stale = {}
+        # playlist the Player snapshot was built for
+        self._snapshot_playlist = None
+
+        self._stats_source = None
+        interval = settings.get_option(STATS_INTERVAL_OPTION, 0)
+        if interval > 0:
+            self._stats_source = glib.timeout_add_seconds(interval,
+                    self._on_stats_timer)
+        TRACE.set_enabled(settings.get_option(TRACE_OPTION, False))
 
     ## Introspectable methods
 
-    @dbus.service.method("org.freedesktop.DBus.Introspectable")
     def Introspect(self):
         return MPRIS2_INTROSPECTION
 
     ## Properties methods
 
-    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='ss', out_signature='v')
     def Get(self, interface, prop):
-        if prop in self._properties:
-            return getattr(self, prop)
-        else:
-            return None
+        if prop in self._properties.get(interface, ()):
+            if prop in self._volatile_properties:
+                return self._compute(prop)
+            return self._get_snapshot(interface)[prop]
+        raise UnknownProperty("no property %s.%s" % (interface, prop))
 
-    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='s', out_signature='a{sv}')
     def GetAll(self, interface):
-        res = {}
-        for prop in self._properties:
-            res[prop] = getattr(self, prop)
+        if interface not in self._properties:
+            return {}
+        res = self._get_snapshot(interface)
+        volatile = self._volatile_properties.intersection(
+                self._properties[interface])
+        if volatile:
+            res = dict(res)
+            for prop in volatile:
+                res[prop] = self._compute(prop)
         return res
 
-    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='ssv')
     def Set(self, interface, prop, value):
-        if prop in self._properties:
-            setattr(self, prop, value)
+        if prop not in self._properties.get(interface, ()):
+            raise UnknownProperty("no property %s.%s" % (interface, prop))
+        if (interface, prop) not in self._writable_properties:
+            raise PropertyReadOnly("%s.%s is read-only" % (interface, prop))
+        writer = self._writers.get(prop)
+        if writer is None:
+            writer = self._writers[prop] = Throttle(self._write_interval,
+                    lambda value: self._write_property(interface, prop, value),
+                    lambda: self._on_writes_settled(interface, prop))
+        if not writer.push(value):
+            STATS.count('set.merged')
+
+    def _write_property(self, interface, prop, value):
+        setattr(self, prop, value)
+        self.mark_stale(interface, prop)
+        # the writer knows the new value, so the change events it causes
+        # are taken as already sent
+        self._emitted.setdefault(interface, {})[prop] = self._compute(prop)
+
+    def _on_writes_settled(self, interface, prop):
+        # now tell everybody, once
+        self._emitted.get(interface, {}).pop(prop, None)
+        self.populate(interface, prop)
+
+    def mark_stale(self, interface, *prop_names):
+        """ the values of prop_names need to be computed again """
+        self._stale.setdefault(interface, set()).update(prop_names)
+
+    def _get_snapshot(self, interface):
+        """ values of the non-volatile properties of interface; stale ones
+            are computed again in a new snapshot """
+        if interface == ORG_MPRIS_MEDIAPLAYER2_PLAYER:
+            # switching playlists sends no event, but repeat and shuffle
+            # modes belong to the playlist on newer versions
+            playlist = QUEUE.current_playlist
+            if playlist is not self._snapshot_playlist:
+                self._snapshot_playlist = playlist
+                self.mark_stale(interface, *PLAYLIST_PROPERTIES)
+        snapshot = self._snapshots.get(interface)
+        stale = self._stale.pop(interface, None)
+        if snapshot is None:
+            snapshot = dict((p, self._compute(p))
+                    for p in self._properties[interface]
+                    if p not in self._volatile_properties)
+        elif stale:
+            snapshot = dict(snapshot)
+            for p in stale:
+                if p in snapshot:
+                    snapshot[p] = self._compute(p)
+        else:
+            return snapshot
+        self._snapshots[interface] = snapshot
+        return snapshot
+
+    def _compute(self, prop):
+        start = time.time()
+        value = getattr(self, prop)
+        STATS.record('property.%s' % prop, time.time() - start)
+        return value
+
+    def _set_snapshot_value(self, interface, prop, value):
+        snapshot = self._snapshots.get(interface)
+        if snapshot is not None and prop in snapshot:
+            snapshot = dict(snapshot)
+            snapshot[prop] = value
+            self._snapshots[interface] = snapshot
 
     ## Properties signals
 
-    @dbus.service.signal(dbus.PROPERTIES_IFACE, signature='sa{sv}as')
     def PropertiesChanged(self, interface, updated, invalid):
-        pass
+        self.emit_signal(ORG_FREEDESKTOP_DBUS_PROPERTIES, 'PropertiesChanged',
+                interface, updated, invalid)
+
+    def emit_signal(self, interface, name, *args):
+        if self.transport is not None:
+            self.transport.emit_signal(interface, name, args)
 
     def populate(self, interface, *prop_names):
-        logger.info("populate: %s" % repr(prop_names))
-        props = {}
+        """ queue a PropertiesChanged for prop_names
+
+            Changes queued during the same main loop iteration (or emit
+            delay) are merged and each property is computed once in flush().
+            """
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("populate: %r", prop_names)
+        if TRACE.enabled:
+            TRACE.add('populate', "%s %r" % (interface, prop_names))
+        if not self.has_listeners():
+            # nobody would get the signal, compute them when asked for
+            for p in prop_names:
+                self.mark_stale(interface, p[0] if type(p) is tuple else p)
+            return
+        pending = self._pending.setdefault(interface, {})
         for p in prop_names:
             if type(p) is tuple:
                 # NOTE: This is a hack to fix the early-populate problem described
                 #       in the comments of on_playback_start()
                 p, v = p
-                props[p] = v
+                pending[p] = v
             else:
-                props[p] = getattr(self, p)
+                pending[p] = _COMPUTE
+            self.mark_stale(interface, p)
+        if self._flush_source is None:
+            delay = settings.get_option(EMIT_DELAY_OPTION, 0)
+            if delay > 0:
+                self._flush_source = glib.timeout_add(delay, self._on_flush)
+            else:
+                self._flush_source = glib.idle_add(self._on_flush)
+
+    def announce(self, interface, *prop_names):
+        """ signal prop_names right away, even if nobody called in yet
+            (sound menus registering players from the signal alone) """
+        snapshot = self._get_snapshot(interface)
+        props = dict((p, snapshot[p]) for p in prop_names)
+        self._emitted.setdefault(interface, {}).update(props)
+        self.emit_stats['emitted'] += len(props)
+        if TRACE.enabled:
+            TRACE.add('emit', "%s %s" % (interface, sorted(props)))
         self.PropertiesChanged(interface, props, [])
 
+    def flush(self):
+        """ emit the queued property changes right away
+
+            Properties whose value didn't change since they were last
+            emitted are left out, and nothing is sent if none changed.
+            """
+        start = time.time()
+        self.cancel_flush()
+        pending, self._pending = self._pending, {}
+        for interface, pending_props in pending.items():
+            emitted = self._emitted.setdefault(interface, {})
+            if interface in self._properties:
+                snapshot = self._get_snapshot(interface)
+            else:
+                snapshot = {}
+            props = {}
+            for p, v in pending_props.items():
+                if v is _COMPUTE:
+                    if p in snapshot:
+                        v = snapshot[p]
+                    else:
+                        v = self._compute(p)
+                else:
+                    self._set_snapshot_value(interface, p, v)
+                if p in emitted and emitted[p] == v:
+                    self.emit_stats['suppressed'] += 1
+                    continue
+                emitted[p] = v
+                props[p] = v
+            if props:
+                self.emit_stats['emitted'] += len(props)
+                if TRACE.enabled:
+                    TRACE.add('emit', "%s %s" % (interface, sorted(props)))
+                self.PropertiesChanged(interface, props, [])
+        STATS.record('flush', time.time() - start)
+
+    def has_listeners(self):
+        """ whether signals would reach anybody """
+        return not self._listener_aware or len(self.listeners) > 0
+
+    def _on_listeners_changed(self, active):
+        if active:
+            # what was sent before is no reference for the new listeners
+            self._emitted.clear()
+            self.tracklist.forget_published()
+            self.prefetcher.schedule()
+        else:
+            self._pending = {}
+            self.cancel_flush()
+            self._seeked_throttle.cancel()
+            self.prefetcher.cancel()
+            self.tracklist.cancel()
+
+    def shutdown(self):
+        """ stop pending emissions and background work """
+        self.listeners.clear()
+        if self._stats_source is not None:
+            glib.source_remove(self._stats_source)
+            self._stats_source = None
+        self.cancel_flush()
+        self.commands.cancel()
+        for writer in self._writers.values():
+            writer.flush()
+        self.playlist_access.settings.flush()
+        self._seek_throttle.cancel()
+        self._seeked_throttle.cancel()
+        self.prefetcher.cancel()
+        self.tracklist.cancel()
+        self.position.stop()
+        self._cover_pool.stop()
+        self._covers_in_flight.clear()
+        self._tag_pool.stop()
+        self.enqueuer.cancel()
+
+    def cancel_flush(self):
+        if self._flush_source is not None:
+            glib.source_remove(self._flush_source)
+            self._flush_source = None
+
+    def _on_flush(self):
+        self._flush_source = None
+        self.flush()
+        return False
+
     ## main methods
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2)
     def Quit(self):
         self.exaile.quit()
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2)
     def Raise(self):
         self.exaile.gui.main.toggle_visible(True)
 
@@ -259,8 +817,7 @@ class Mpris2Adapter(dbus.service.Object):
 
     @property
     def HasTrackList(self):
-        # TODO: implement TrackList
-        return False
+        return True
 
     @property
     def Identity(self):
@@ -272,65 +829,122 @@ class Mpris2Adapter(dbus.service.Object):
 
     @property
     def SupportedUriSchemes(self):
-        # TODO: return supported GFile schemes
-        return ['file', 'http', 'https']
+        return list(self.formats.uri_schemes)
 
     @property
     def SupportedMimeTypes(self):
-        # TODO: return supported GStreamer types
-        return [
-            'audio/mpeg',
-            'audio/ogg',
-            'audio/vorbis',
-        ]
+        return list(self.formats.mime_types)
+
+    def discover_formats(self):
+        """ look for the supported formats in the background, the
+            defaults are used meanwhile """
+        # a one-off, the threads reading tags can take it
+        self._tag_pool.submit(self.formats.discover, (),
+                self._on_formats_discovered)
+
+    def _on_formats_discovered(self, formats):
+        self.formats.set(formats)
+        # not signalled, their EmitsChangedSignal is false
+        self.mark_stale(ORG_MPRIS_MEDIAPLAYER2, 'SupportedMimeTypes',
+                'SupportedUriSchemes')
 
     ## Player methods
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_PLAYER)
+    # the player commands are queued, see CommandQueue
+
     def Next(self):
-        QUEUE.next()
+        self.commands.push('skip', 1)
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_PLAYER, in_signature='s')
     def OpenUri(self, uri):
-        self.exaile.gui.open_uri(uri)
+        self.commands.push('open_uri', uri)
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_PLAYER)
     def Pause(self):
-        PLAYER.pause()
+        self.commands.push('state', 'Paused')
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_PLAYER)
     def Play(self):
-        QUEUE.play()
+        self.commands.push('state', 'Playing')
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_PLAYER)
     def PlayPause(self):
-        if PLAYER.is_stopped():
-            QUEUE.play()
-        else:
-            PLAYER.toggle_pause()
+        self.commands.push('state', 'Toggle')
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_PLAYER)
     def Previous(self):
-        QUEUE.prev()
+        self.commands.push('skip', -1)
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_PLAYER, in_signature='x')
     def Seek(self, offset):
-        position = PLAYER.get_position() / NANOSECOND
-        position += offset / MICROSECOND
-        PLAYER.seek(position)
+        position = self.position.get_position() + offset / MICROSECOND * NANOSECOND
+        self.seek(max(int(round(position)), 0))
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_PLAYER, in_signature='ox')
     def SetPosition(self, track_id, position):
-        if track_id == self._get_trackid(PLAYER.current):
-            position /= MICROSECOND
-            PLAYER.seek(position)
+        if PLAYER.current is not None and \
+                self.track_ids.get_track(track_id) is PLAYER.current:
+            self.seek(int(round(position / MICROSECOND * NANOSECOND)))
         else:
             # treat request as stale
             pass
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_PLAYER)
     def Stop(self):
-        PLAYER.stop()
+        self.commands.push('state', 'Stopped')
+
+    def _run_command(self, name, arg):
+        if name == 'skip':
+            self._skip(arg)
+        elif name == 'state':
+            self._set_playback_status(arg)
+        elif name == 'open_uri':
+            self.exaile.gui.open_uri(arg)
+
+    def _skip(self, count):
+        """ go count tracks forward, or backward if negative """
+        target = None
+        if abs(count) > 1:
+            target = self._get_skip_target(count)
+        if target is None:
+            step = QUEUE.next if count > 0 else QUEUE.prev
+            for i in range(abs(count)):
+                step()
+            return
+        playlist = QUEUE.current_playlist
+        self.playlist_access.set_current_position(playlist,
+                self._get_position(target))
+        QUEUE.play(track=target)
+
+    def _get_skip_target(self, count):
+        # jump straight to the track count steps away when it's known, to
+        # start a single track instead of all the ones in between
+        if self.playlist_access.get_queued(QUEUE, 1):
+            return None
+        if count > 0:
+            tracks = self.prefetcher.predict(count)
+            return tracks[-1] if len(tracks) == count else None
+        if self.Shuffle or self.LoopStatus == 'Track':
+            return None
+        try:
+            position = self._get_position(PLAYER.current)
+        except ValueError:
+            return None
+        position += count
+        if position < 0:
+            if self.LoopStatus != 'Playlist':
+                return None
+            position %= len(QUEUE.current_playlist)
+        return QUEUE.current_playlist[position]
+
+    def _set_playback_status(self, status):
+        if status == 'Toggle':
+            if PLAYER.is_stopped():
+                QUEUE.play()
+            else:
+                PLAYER.toggle_pause()
+        elif status == 'Playing':
+            if PLAYER.is_stopped():
+                QUEUE.play()
+            elif PLAYER.is_paused():
+                PLAYER.toggle_pause()
+        elif status == 'Paused':
+            if PLAYER.is_playing():
+                PLAYER.pause()
+        elif not PLAYER.is_stopped():
+            PLAYER.stop()
 
     ## Player properties
 
@@ -341,10 +955,9 @@ class Mpris2Adapter(dbus.service.Object):
     @property
     def CanGoNext(self):
         if self.LoopStatus == 'None':
-            track = PLAYER.current
             playlist = QUEUE.current_playlist
             try:
-                return not ((len(playlist)-1) == playlist.index(track))
+                return not ((len(playlist)-1) == self._get_position(PLAYER.current))
             except ValueError:
                 return False
         else:
@@ -353,10 +966,8 @@ class Mpris2Adapter(dbus.service.Object):
     @property
     def CanGoPrevious(self):
         if self.LoopStatus == 'None':
-            track = PLAYER.current
-            playlist = QUEUE.current_playlist
             try:
-                return playlist.index(track) > 0
+                return self._get_position(PLAYER.current) > 0
             except ValueError:
                 return False
         else:
@@ -378,56 +989,11 @@ class Mpris2Adapter(dbus.service.Object):
 
     @property
     def LoopStatus(self):
-        playlist = QUEUE.current_playlist
-        if hasattr(playlist, "repeat_enabled"):
-            # <= 0.3.2
-            mode = playlist.repeat_mode
-            enabled = playlist.repeat_enabled
-            logger.debug("LoopStatus get: old, %r, %r" % (enabled, mode))
-        else:
-            # >= 0.3.3
-            mode = playlist.get_repeat_mode()
-            enabled = (mode != 'disabled')
-            logger.debug("LoopStatus get: new, %r, %r" % (enabled, mode))
-
-        if enabled:
-            if mode == 'playlist':
-                # <= 0.3.2
-                return 'Playlist'
-            elif mode == 'all':
-                # >= 0.3.3
-                return 'Playlist'
-            else:
-                return 'Track'
-        else:
-            return 'None'
+        return self.playlist_access.get_loop_status(QUEUE.current_playlist)
 
     @LoopStatus.setter
     def LoopStatus(self, value):
-        playlist = QUEUE.current_playlist
-        if hasattr(playlist, "set_repeat"):
-            # <= 0.3.2
-            if value == 'Playlist':
-                enabled, mode = True, 'playlist'
-            elif value == 'Track':
-                enabled, mode = True, 'track'
-            else:
-                enabled, mode = False, 'none'
-            logger.debug("LoopStatus set: old, %r, %r" % (enabled, mode))
-            playlist.set_repeat(enabled, mode)
-            settings.set_option('playback/repeat', enabled)
-            if enabled:
-                settings.set_option('playback/repeat_mode', mode)
-        else:
-            # >= 0.3.3
-            if value == 'Playlist':
-                mode = 'all'
-            elif value == 'Track':
-                mode = 'track'
-            else:
-                mode = 'disabled'
-            logger.debug("LoopStatus set: new, %r" % mode)
-            playlist.set_repeat_mode(mode)
+        self.playlist_access.set_loop_status(QUEUE.current_playlist, value)
 
     @property
     def MaximumRate(self):
@@ -448,8 +1014,7 @@ class Mpris2Adapter(dbus.service.Object):
 
     @property
     def Position(self):
-        pos = PLAYER.get_position() / NANOSECOND * MICROSECOND
-        return dbus.Int64(pos)
+        return int(self.position.get_position() / NANOSECOND * MICROSECOND)
 
     @property
     def Rate(self):
@@ -468,36 +1033,11 @@ class Mpris2Adapter(dbus.service.Object):
 
     @property
     def Shuffle(self):
-        playlist = QUEUE.current_playlist
-        if hasattr(playlist, 'get_shuffle_mode'):
-            # >= 0.3.3
-            mode = (playlist.get_shuffle_mode() != 'disabled')
-            logger.debug("Shuffle get: new, %r" % mode)
-        else:
-            # <= 0.3.2
-            mode = settings.get_option('playback/shuffle', False)
-            logger.debug("Shuffle get: old, %r" % mode)
-        return mode
+        return self.playlist_access.get_shuffle(QUEUE.current_playlist)
 
     @Shuffle.setter
     def Shuffle(self, value):
-        playlist = QUEUE.current_playlist
-        if hasattr(playlist, 'set_shuffle_mode'):
-            # >= 0.3.3
-            logger.debug("Shuffle set: new, %r" % value)
-            if value:
-                # TODO: This should toggle on/off like it did in 0.3.2, without
-                #       resetting the mode to 'track' if it was 'album' previously.
-                if self.Shuffle:
-                    # Ensure the current mode is kept for 'on' -> 'on' changes.
-                    return
-                playlist.set_shuffle_mode('track')
-            else:
-                playlist.set_shuffle_mode('disabled')
-        else:
-            # <= 0.3.2
-            logger.debug("Shuffle set: old, %r" % value)
-            settings.set_option('playback/shuffle', bool(value))
+        self.playlist_access.set_shuffle(QUEUE.current_playlist, value)
 
     @property
     def Volume(self):
@@ -510,109 +1050,297 @@ class Mpris2Adapter(dbus.service.Object):
 
     ## Player signals
 
-    @dbus.service.signal(ORG_MPRIS_MEDIAPLAYER2_PLAYER, signature='x')
     def Seeked(self, position):
-        pass
+        self.emit_signal(ORG_MPRIS_MEDIAPLAYER2_PLAYER, 'Seeked', position)
 
-    ## TrackList methods
+    def seek(self, position):
+        """ seek to position (in nanoseconds)
 
-    # TODO: implement according to:
-    # http://specifications.freedesktop.org/mpris-spec/latest/TrackList_Node.html
+            Seeks closer together than the seek interval end up as one
+            seek to the last position. The position clock moves right away
+            so that relative seeks in between add up.
+            """
+        self.position.seeked(position)
+        if not self._seek_throttle.push(position):
+            STATS.count('seek.coalesced')
 
-    def GetTracksMetadata(self, track_ids):
-        pass
+    def _do_seek(self, position):
+        PLAYER.seek(position / NANOSECOND)
+
+    def seeked(self, position):
+        """ emit Seeked for position (in microseconds), throttled """
+        if not self.has_listeners():
+            return
+        if not self._seeked_throttle.push(position):
+            STATS.count('seeked.coalesced')
+
+    def _emit_seeked(self, position):
+        self.emit_stats['seeked'] += 1
+        self.Seeked(int(position))
+
+    ## TrackList methods
+
+    def GetTracksMetadata(self, track_ids, reply_handler, error_handler):
+        self.tracklist.get_metadata(track_ids, reply_handler, error_handler)
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_TRACKLIST, in_signature='sob')
     def AddTrack(self, uri, after_track, set_as_current):
-        pass
+        if after_track == NO_TRACK:
+            after = START
+        else:
+            after = self.track_ids.get_track(after_track)
+            if after is None:
+                after = END
+        self.enqueuer.enqueue([uri], after, set_as_current)
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_TRACKLIST, in_signature='o')
     def RemoveTrack(self, trackId):
-        pass
+        track = self.track_ids.get_track(trackId)
+        try:
+            position = self._get_position(track)
+        except ValueError:
+            return
+        self.playlist_access.remove_track(QUEUE.current_playlist, position)
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_TRACKLIST, in_signature='o')
-    def Goto(self, trackId):
-        pass
+    def GoTo(self, trackId):
+        track = self.track_ids.get_track(trackId)
+        playlist = QUEUE.current_playlist
+        try:
+            position = self._get_position(track)
+        except ValueError:
+            # not (or no longer) in the current playlist
+            return
+        self.playlist_access.set_current_position(playlist, position)
+        QUEUE.play(track=track)
 
-    @dbus.service.method(ORG_MPRIS_MEDIAPLAYER2_TRACKLIST, out_signature='ao')
-    def Tracks(self):
-        pass
+    ## TrackList signals
+
+    def TrackListReplaced(self, tracks, current_track):
+        self.emit_signal(ORG_MPRIS_MEDIAPLAYER2_TRACKLIST, 'TrackListReplaced',
+                tracks, current_track)
+
+    def TrackAdded(self, metadata, after_track):
+        self.emit_signal(ORG_MPRIS_MEDIAPLAYER2_TRACKLIST, 'TrackAdded',
+                metadata, after_track)
+
+    def TrackRemoved(self, track_id):
+        self.emit_signal(ORG_MPRIS_MEDIAPLAYER2_TRACKLIST, 'TrackRemoved',
+                track_id)
+
+    def TrackMetadataChanged(self, track_id, metadata):
+        self.emit_signal(ORG_MPRIS_MEDIAPLAYER2_TRACKLIST,
+                'TrackMetadataChanged', track_id, metadata)
+
+    def invalidate_tracks(self):
+        self.mark_stale(ORG_MPRIS_MEDIAPLAYER2_TRACKLIST, 'Tracks')
+        self.PropertiesChanged(ORG_MPRIS_MEDIAPLAYER2_TRACKLIST, {}, ['Tracks'])
 
     ## TrackList properties
 
+    @property
     def CanEditTracks(self):
-        return False
+        return True
+
+    @property
+    def Tracks(self):
+        return list(self.tracklist.get_ids())
+
+    ## Exaile methods
+
+    def EnqueueUris(self, uris, play):
+        """ add uris to the current playlist in the background, their
+            progress is reported by the signals below """
+        return self.enqueuer.enqueue(uris, END, play)
+
+    ## Exaile signals
+
+    def EnqueueProgress(self, job, done, total):
+        self.emit_signal(ORG_EXAILE_MPRIS2, 'EnqueueProgress', job, done, total)
+
+    def EnqueueFinished(self, job, added):
+        self.emit_signal(ORG_EXAILE_MPRIS2, 'EnqueueFinished', job, added)
+
+    ## Debug methods
+
+    def GetStats(self):
+        stats = STATS.get_summary()
+        hits, misses = self.cover_cache.hits, self.cover_cache.misses
+        stats['cover_cache'] = {
+            'hits': float(hits),
+            'misses': float(misses),
+            'hit_ratio': float(hits) / (hits + misses) if hits + misses else 0.0,
+        }
+        stats['emission'] = dict((name, float(value))
+                for name, value in self.emit_stats.items())
+        return stats
+
+    def ResetStats(self):
+        STATS.reset()
+        self.cover_cache.hits = self.cover_cache.misses = 0
+        self.emit_stats = {'emitted': 0, 'suppressed': 0, 'seeked': 0}
+
+    def SetTrace(self, enabled):
+        TRACE.set_enabled(enabled)
+
+    def GetTrace(self):
+        return TRACE.get_events()
+
+    def _on_stats_timer(self):
+        STATS.log_summary()
+        return True
 
     ## Helper functions
 
+    def _get_position(self, track):
+        return self.playlist_index.index(QUEUE.current_playlist, track)
+
     def _get_trackid(self, track):
-        try:
-            idx = QUEUE.current_playlist.index(track)
-            return "/org/exaile/Exaile/CurrentPlaylist/Track%d" % (idx+1)
-        except ValueError:
-            # TODO: find a better response than this
-            #       (but on the other hand, this shouldn't happen anyway)
-            return "/org/exaile/Exaile/NotInCurrentPlaylist"
+        return self.track_ids.get_path(track)
 
-    def _parse_trackid(self, trackid):
-        if track.startswith("/org/exaile/Exaile/CurrentPlaylist/Track"):
-            return int(track[40:])-1
+    def _get_track(self, trackid):
+        return self.track_ids.get_track(trackid)
+
+    def invalidate_metadata(self, track=None):
+        """ forget the cached metadata of track, or of all tracks """
+        if track is None:
+            self._metadata_cache.clear()
         else:
-            return None
+            self._metadata_cache.pop(track, None)
+        if track is None or track is PLAYER.current:
+            self.mark_stale(ORG_MPRIS_MEDIAPLAYER2_PLAYER, 'Metadata')
+
+    def cover_changed(self, track):
+        """ the cover of track was set or removed in Exaile """
+        # covers are shared by the tracks of an album, which aren't known
+        # here: forget the tracks found without one and all the metadata
+        self._no_cover.clear()
+        self.cover_cache.invalidate(track.get_tag_raw('__loc'))
+        self.invalidate_metadata()
 
     def _get_metadata(self, track):
+        if track is None:
+            return {}
+
+        try:
+            meta = self._metadata_cache.pop(track)
+        except KeyError:
+            meta = self._build_metadata(track)
+        self._metadata_cache[track] = meta
+        while len(self._metadata_cache) > METADATA_CACHE_SIZE:
+            self._metadata_cache.popitem(last=False)
+        return meta
+
+    def _build_metadata(self, track):
         meta = {}
 
-        if track is not None:
-            ## MPRIS v2 meta map, defined at http://xmms2.org/wiki/MPRIS_Metadata
+        ## MPRIS v2 meta map, defined at http://xmms2.org/wiki/MPRIS_Metadata
 
-            meta['mpris:trackid'] = dbus.ObjectPath(self._get_trackid(track))
+        meta['mpris:trackid'] = self._get_trackid(track)
 
-            meta['xesam:url'] = track.get_tag_raw('__loc')
+        meta['xesam:url'] = track.get_tag_raw('__loc')
 
-            title = track.get_tag_raw('title')
-            if title:
-                meta['xesam:title'] = title[0]
+        title = track.get_tag_raw('title')
+        if title:
+            meta['xesam:title'] = title[0]
 
-            artist = track.get_tag_raw('artist')
-            if artist:
-                meta['xesam:artist'] = dbus.types.Array(artist, signature='s')
+        artist = track.get_tag_raw('artist')
+        if artist:
+            meta['xesam:artist'] = list(artist)
 
-            album = track.get_tag_raw('album')
-            if album:
-                meta['xesam:album'] = album[0]
+        album = track.get_tag_raw('album')
+        if album:
+            meta['xesam:album'] = album[0]
 
-            genre = track.get_tag_raw('genre')
-            if genre:
-                meta['xesam:genre'] = dbus.types.Array(genre, signature='s')
+        genre = track.get_tag_raw('genre')
+        if genre:
+            meta['xesam:genre'] = list(genre)
 
-            meta['xesam:userRating'] = track.get_rating() / 5.0
+        meta['xesam:userRating'] = track.get_rating() / 5.0
 
-            tracklen = track.get_tag_raw('__length')
-            if tracklen:
-                meta['mpris:length'] = dbus.types.Int64(tracklen * MICROSECOND)
+        tracklen = track.get_tag_raw('__length')
+        if tracklen:
+            meta['mpris:length'] = int(tracklen * MICROSECOND)
 
-            # this is a workaround, write data to a tmp file and return name
-            cover_temp = self._get_cover_url(track)
-            if cover_temp:
-                meta['mpris:artUrl'] = cover_temp
+        # this is a workaround, write data to a tmp file and return name
+        cover_temp = self._get_cover_url(track)
+        if cover_temp:
+            meta['mpris:artUrl'] = cover_temp
+            if self.cover_cache.keep_original:
+                original = self.cover_cache.lookup(meta['xesam:url'],
+                        original=True)
+                if original:
+                    meta['exaile:artUrlOriginal'] = original
 
-        return dbus.types.Dictionary(meta, signature='sv', variant_level=1)
+        return meta
 
     def _get_cover_url(self, track):
-        trackid = track.get_tag_raw('__loc')
-        trackhash = hashlib.sha1(trackid).hexdigest()
-        if trackid not in self.cover_cache:
-            cover_data = cover_manager.get_cover(track)
-            if cover_data is not None:
-                tempfile = os.path.join(xdg.get_cache_dir(), "cover-%s" % trackhash)
-                try:
-                    with open(tempfile, 'wb') as f:
-                        f.write(cover_data)
-                except BaseException as ex:
-                    logger.error("Unable to export cover: %r" % ex)
-                    return None
-                self.cover_cache[trackid] = "file://%s" % tempfile
-            else:
-                return None
-        return self.cover_cache[trackid]
+        """ exported cover of track, None if there is none or it is still
+            being fetched (Metadata is emitted again once it is ready) """
+        loc = track.get_tag_raw('__loc')
+        if loc in self._no_cover:
+            return None
+        url = self.cover_cache.lookup(loc)
+        if url is not None:
+            return url
+        self._request_cover(self._get_cover_key(track, loc), loc, track)
+        return None
+
+    def _request_cover(self, key, loc, track):
+        waiting = self._covers_in_flight.get(key)
+        if waiting is not None:
+            waiting.append((loc, track))
+        else:
+            self._covers_in_flight[key] = [(loc, track)]
+            self._cover_pool.submit(self._export_cover, (track, loc),
+                    lambda url: self._on_cover_exported(key, loc, url),
+                    lambda ex: self._on_cover_failed(key))
+
+    def _get_cover_key(self, track, loc):
+        # tracks of the same album share their cover, only fetch it once
+        album = track.get_tag_raw('album')
+        if album:
+            artist = track.get_tag_raw('albumartist') or \
+                    track.get_tag_raw('artist') or []
+            return ('album', tuple(artist), tuple(album))
+        return ('loc', loc)
+
+    def _export_cover(self, track, loc):
+        # runs in a worker thread
+        start = time.time()
+        try:
+            return self._do_export_cover(track, loc)
+        finally:
+            STATS.record('cover.export', time.time() - start)
+
+    def _do_export_cover(self, track, loc):
+        # the index is loaded by the first export, off the main loop
+        self.cover_cache.ensure_loaded()
+        url = self.cover_cache.lookup(loc)
+        if url is not None:
+            return url
+        from xl.covers import MANAGER as cover_manager
+        cover_data = cover_manager.get_cover(track)
+        if cover_data is None:
+            return None
+        url = self.cover_cache.store(loc, cover_data)
+        if url is None:
+            raise IOError("unable to export the cover of %s" % loc)
+        return url
+
+    def _on_cover_exported(self, key, exported_loc, url):
+        for loc, track in self._covers_in_flight.pop(key, []):
+            if url is None:
+                if loc == exported_loc:
+                    self._no_cover.add(loc)
+                else:
+                    # its album-mate has no art of its own, this one may
+                    self._request_cover(('loc', loc), loc, track)
+                continue
+            if loc != exported_loc:
+                self.cover_cache.alias(loc, exported_loc)
+            self.invalidate_metadata(track)
+            if track is PLAYER.current:
+                self.populate(ORG_MPRIS_MEDIAPLAYER2_PLAYER, 'Metadata')
+
+    def _on_cover_failed(self, key):
+        # not taken as having no cover: tried again when the metadata of
+        # the waiting tracks is built again
+        self._covers_in_flight.pop(key, None)
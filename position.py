@@ -0,0 +1,128 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import glib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+NANOSECOND = 1/0.000000001
+
+# python 2 has no monotonic clock
+_clock = getattr(time, 'monotonic', time.time)
+
+class PositionClock(object):
+    """ extrapolates the playback position without querying the pipeline
+
+        The position read from the player is kept along with the time it
+        was read at, and later reads are extrapolated from it. It is read
+        again when playback starts, pauses or seeks, and every
+        resync_interval seconds while playing; if the extrapolated position
+        was off by more than drift_threshold seconds, on_drift is called
+        with the real position (in nanoseconds).
+        """
+
+    def __init__(self, player, resync_interval, drift_threshold, on_drift):
+        self.player = player
+        self.resync_interval = resync_interval
+        self.drift_threshold = drift_threshold * NANOSECOND
+        self.on_drift = on_drift
+        # (position in ns, clock time, playing) or None
+        self._anchor = None
+        self._timer = None
+
+    def get_position(self):
+        """ current position in nanoseconds """
+        if self._anchor is None:
+            return self.resync()
+        position, stamp, playing = self._anchor
+        if playing and _clock() - stamp > self.resync_interval:
+            return self._check_drift()
+        return self._extrapolate()
+
+    def resync(self, playing=None):
+        """ read the position from the player again; playing overrides
+            the player state, which lags behind on track start """
+        position = self.player.get_position()
+        self._set_anchor(position, playing)
+        return position
+
+    def seeked(self, position):
+        """ the player seeked to position (in nanoseconds) """
+        self._set_anchor(position)
+
+    def stop(self):
+        self._anchor = None
+        self._stop_timer()
+
+    def _set_anchor(self, position, playing=None):
+        if playing is None:
+            playing = self.player.is_playing()
+        self._anchor = (position, _clock(), playing)
+        if playing:
+            if self._timer is None:
+                self._timer = glib.timeout_add(
+                        int(self.resync_interval * 1000), self._on_timer)
+        else:
+            self._stop_timer()
+
+    def _extrapolate(self):
+        position, stamp, playing = self._anchor
+        if not playing:
+            return position
+        position += (_clock() - stamp) * NANOSECOND
+        track = self.player.current
+        if track is not None:
+            length = track.get_tag_raw('__length')
+            if length:
+                position = min(position, length * NANOSECOND)
+        return int(position)
+
+    def _check_drift(self):
+        expected = self._extrapolate()
+        position = self.resync()
+        if abs(position - expected) > self.drift_threshold:
+            logger.debug("Position drifted by %d ms",
+                    (position - expected) / 1000000)
+            self.on_drift(position)
+        return position
+
+    def _stop_timer(self):
+        if self._timer is not None:
+            glib.source_remove(self._timer)
+            self._timer = None
+
+    def _on_timer(self):
+        if self._anchor is None or not self._anchor[2]:
+            self._timer = None
+            return False
+        self._check_drift()
+        return True
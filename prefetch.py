@@ -0,0 +1,106 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import glib
+import logging
+
+from xl.player import PLAYER, QUEUE
+
+logger = logging.getLogger(__name__)
+
+class Prefetcher(object):
+    """ warms the metadata and cover caches for the tracks likely to be
+        played next, one track per idle callback """
+
+    def __init__(self, adapter, count):
+        self.adapter = adapter
+        self.count = count
+        self._source = None
+        self._pending = []
+
+    def schedule(self):
+        """ predict the next tracks again and warm them when idle """
+        if self.count <= 0 or not self.adapter.has_listeners():
+            return
+        self._pending = None
+        if self._source is None:
+            self._source = glib.idle_add(self._on_idle,
+                    priority=glib.PRIORITY_LOW)
+
+    def cancel(self):
+        if self._source is not None:
+            glib.source_remove(self._source)
+            self._source = None
+        self._pending = []
+
+    def predict(self, count=None):
+        """ the count (by default self.count) tracks expected to play
+            after the current one """
+        if count is None:
+            count = self.count
+        tracks = self._get_queued(count)
+        if len(tracks) < count:
+            tracks.extend(self._get_upcoming(count - len(tracks)))
+        return tracks
+
+    def _get_queued(self, count):
+        return self.adapter.playlist_access.get_queued(QUEUE, count)
+
+    def _get_upcoming(self, count):
+        if self.adapter.Shuffle:
+            # can't be predicted
+            return []
+        loop = self.adapter.LoopStatus
+        if loop == 'Track':
+            return []
+        playlist = QUEUE.current_playlist
+        try:
+            position = self.adapter._get_position(PLAYER.current)
+        except ValueError:
+            return []
+        length = len(playlist)
+        tracks = []
+        for i in range(1, count + 1):
+            if position + i < length:
+                tracks.append(playlist[position + i])
+            elif loop == 'Playlist' and length > 0:
+                tracks.append(playlist[(position + i) % length])
+        return tracks
+
+    def _on_idle(self):
+        if self._pending is None:
+            self._pending = self.predict()
+        if not self._pending:
+            self._source = None
+            return False
+        track = self._pending.pop(0)
+        if track is not None and track is not PLAYER.current:
+            self.adapter._get_metadata(track)
+        return True
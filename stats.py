@@ -0,0 +1,164 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import collections
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# timings are bucketed by powers of two of microseconds
+_BUCKETS = 32
+
+class Timer(object):
+    """ count, total, maximum and a log2 histogram of durations """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * _BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        micro = seconds * 1000000
+        bucket = int(math.log(micro, 2)) + 1 if micro >= 1 else 0
+        self.buckets[min(bucket, _BUCKETS - 1)] += 1
+
+    def percentile(self, q):
+        """ upper bound of the q quantile, in seconds """
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min((2 ** bucket) / 1000000.0, self.max)
+        return self.max
+
+    def summary(self):
+        """ the numbers exported by GetStats, in milliseconds """
+        return {
+            'count': float(self.count),
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+            'max_ms': self.max * 1000,
+            'p50_ms': self.percentile(0.5) * 1000,
+            'p95_ms': self.percentile(0.95) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000,
+        }
+
+class Stats(object):
+    """ named timers and counters for the plugin's hot paths
+
+        Thread safe, covers are exported from worker threads.
+        """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            try:
+                timer = self.timers[name]
+            except KeyError:
+                timer = self.timers[name] = Timer()
+            timer.add(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def wrap(self, name, function):
+        """ function, timed as name """
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, time.time() - start)
+        return timed
+
+    def reset(self):
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def get_summary(self):
+        """ {timer name: {statistic: value}}, counters under 'counters' """
+        with self._lock:
+            summary = dict((name, timer.summary())
+                    for name, timer in self.timers.items())
+            summary['counters'] = dict((name, float(value))
+                    for name, value in self.counters.items())
+        return summary
+
+    def log_summary(self):
+        summary = self.get_summary()
+        counters = summary.pop('counters')
+        for name in sorted(summary):
+            logger.info("%s: %d calls, mean %.3f ms, p95 %.3f ms, max %.3f ms",
+                    name, summary[name]['count'], summary[name]['mean_ms'],
+                    summary[name]['p95_ms'], summary[name]['max_ms'])
+        for name in sorted(counters):
+            logger.info("%s: %d", name, counters[name])
+
+STATS = Stats()
+
+class Tracer(object):
+    """ ring buffer of the latest (timestamp, kind, detail) events
+
+        Off by default; callers check enabled before building the detail
+        so that it costs one attribute lookup when off.
+        """
+
+    def __init__(self, size=1000):
+        self.enabled = False
+        self._events = collections.deque(maxlen=size)
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        if not self.enabled:
+            self._events.clear()
+
+    def add(self, kind, detail=''):
+        self._events.append((time.time(), kind, detail))
+
+    def get_events(self):
+        """ the buffered events, oldest first """
+        return list(self._events)
+
+TRACE = Tracer()
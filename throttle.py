@@ -0,0 +1,97 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import glib
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Throttle(object):
+    """ calls callback(value) at most once per interval milliseconds
+
+        The first value pushed after a quiet interval goes through right
+        away; values pushed within the interval replace each other and
+        only the last one is passed on when it ends. on_settle() is called
+        once an interval goes by without any value.
+        """
+
+    _NOTHING = object()
+
+    def __init__(self, interval, callback, on_settle=None):
+        self.interval = interval
+        self.callback = callback
+        self.on_settle = on_settle
+        self._pending = self._NOTHING
+        self._source = None
+
+    def push(self, value):
+        """ returns whether value was passed on right away """
+        if self.interval <= 0:
+            self.callback(value)
+            if self.on_settle is not None:
+                self.on_settle()
+            return True
+        if self._source is None:
+            self._source = glib.timeout_add(self.interval, self._on_timeout)
+            self.callback(value)
+            return True
+        self._pending = value
+        return False
+
+    def has_pending(self):
+        return self._pending is not self._NOTHING
+
+    def flush(self):
+        """ pass on the pending value now """
+        self.cancel(flush=True)
+
+    def cancel(self, flush=False):
+        if self._source is not None:
+            glib.source_remove(self._source)
+            self._source = None
+        value, self._pending = self._pending, self._NOTHING
+        if flush and value is not self._NOTHING:
+            self.callback(value)
+
+    def _on_timeout(self):
+        if self._pending is self._NOTHING:
+            self._source = None
+            if self.on_settle is not None:
+                self.on_settle()
+            return False
+        value, self._pending = self._pending, self._NOTHING
+        try:
+            self.callback(value)
+        except Exception:
+            # the source has to outlive a failed call, or it would be gone
+            # with _source still set and nothing passed on ever again
+            logger.exception("Throttled call of %r failed", self.callback)
+        # keep the window open after a trailing call
+        return True
@@ -0,0 +1,179 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import glib
+import logging
+
+from xl.player import PLAYER, QUEUE
+
+logger = logging.getLogger(__name__)
+
+NO_TRACK = '/org/mpris/MediaPlayer2/TrackList/NoTrack'
+TRACKLIST_INTERFACE = 'org.mpris.MediaPlayer2.TrackList'
+
+# number of tracks whose metadata is built per idle callback when
+# answering GetTracksMetadata
+METADATA_BATCH = 50
+
+class TrackListWindow(object):
+    """ the part of the current playlist exposed as TrackList
+
+        Only a window of size tracks around the current track is exposed,
+        so that huge playlists don't turn into huge D-Bus messages. When the
+        window moves, clients are told about the tracks that left and
+        entered it instead of being sent the whole list again.
+        """
+
+    def __init__(self, adapter, size):
+        self.adapter = adapter
+        self.size = size
+        self._tracks = None
+        self._ids = []
+        self._source = None
+        # the window as last signalled to clients
+        self._published = ([], [])
+
+    def get_tracks(self):
+        if self._tracks is None:
+            self._tracks = self._compute_window()
+        return self._tracks
+
+    def get_ids(self):
+        self.get_tracks()
+        return self._ids
+
+    def invalidate(self):
+        self._tracks = None
+
+    def schedule_update(self):
+        """ recompute the window when idle and signal what changed """
+        if not self.adapter.has_listeners():
+            # computed again when asked for
+            self.invalidate()
+            self.adapter.mark_stale(TRACKLIST_INTERFACE, 'Tracks')
+            return
+        if self._source is None:
+            self._source = glib.idle_add(self._on_update)
+
+    def cancel(self):
+        if self._source is not None:
+            glib.source_remove(self._source)
+            self._source = None
+
+    def forget_published(self):
+        """ the next update replaces the whole list """
+        self._published = ([], [])
+
+    def update(self):
+        old_ids, old_tracks = self._published
+        self._tracks = None
+        new_tracks = self.get_tracks()
+        new_ids = self._ids
+        self._published = (new_ids, new_tracks)
+        # an id may refer to another track after the playlist changed
+        old_by_id = dict(zip(old_ids, old_tracks))
+        moved = any(old_by_id.get(trackid, track) is not track
+                for trackid, track in zip(new_ids, new_tracks))
+        if new_ids == old_ids and not moved:
+            return
+
+        new_set = set(new_ids)
+        old_set = set(old_ids)
+        common_old = [i for i in old_ids if i in new_set]
+        common_new = [i for i in new_ids if i in old_set]
+        changes = len(old_ids) - len(common_old) + len(new_ids) - len(common_new)
+        if moved or not common_new or common_old != common_new \
+                or changes > len(new_ids):
+            # reordered, or moved too far for small updates to be cheaper
+            current = self.adapter._get_trackid(PLAYER.current) \
+                    if PLAYER.current is not None else NO_TRACK
+            self.adapter.TrackListReplaced(list(new_ids), current)
+        else:
+            for trackid in old_ids:
+                if trackid not in new_set:
+                    self.adapter.TrackRemoved(trackid)
+            after = NO_TRACK
+            for trackid, track in zip(new_ids, new_tracks):
+                if trackid not in old_set:
+                    self.adapter.TrackAdded(self.adapter._get_metadata(track),
+                            after)
+                after = trackid
+        self.adapter.invalidate_tracks()
+
+    def track_changed(self, track):
+        """ signal new metadata for track, if it's in the window """
+        if self._tracks is not None and track in self._tracks \
+                and self.adapter.has_listeners():
+            self.adapter.TrackMetadataChanged(
+                    self.adapter._get_trackid(track),
+                    self.adapter._get_metadata(track))
+
+    def get_metadata(self, track_ids, reply_handler, error_handler):
+        """ answer GetTracksMetadata, building the metadata in batches
+            of METADATA_BATCH tracks so the main loop keeps running """
+        tracks = []
+        for trackid in track_ids:
+            track = self.adapter._get_track(trackid)
+            if track is not None:
+                tracks.append(track)
+        result = []
+
+        def build_batch():
+            try:
+                for track in tracks[len(result):len(result) + METADATA_BATCH]:
+                    result.append(self.adapter._get_metadata(track))
+            except Exception as ex:
+                error_handler(ex)
+                return False
+            if len(result) < len(tracks):
+                return True
+            reply_handler(result)
+            return False
+
+        if build_batch():
+            glib.idle_add(build_batch)
+
+    def _compute_window(self):
+        playlist = QUEUE.current_playlist
+        length = len(playlist)
+        try:
+            position = self.adapter._get_position(PLAYER.current)
+        except ValueError:
+            position = 0
+        start = max(0, min(position - self.size // 2, length - self.size))
+        end = min(length, start + self.size)
+        tracks = [playlist[i] for i in range(start, end)]
+        self._ids = [self.adapter._get_trackid(track) for track in tracks]
+        return tracks
+
+    def _on_update(self):
+        self._source = None
+        self.update()
+        return False
@@ -0,0 +1,283 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+
+import logging
+import numbers
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+
+from stats import STATS, TRACE
+
+logger = logging.getLogger(__name__)
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+# which backend exports the adapter: 'gdbus', 'dbus-python' or 'auto'
+# (GDBus when it can be loaded, dbus-python otherwise)
+TRANSPORT_OPTION = 'plugin/soundmenu/transport'
+
+def split_signature(signature):
+    """ the complete types making up signature """
+    types = []
+    i = 0
+    while i < len(signature):
+        end = _type_end(signature, i)
+        types.append(signature[i:end])
+        i = end
+    return types
+
+def _type_end(signature, i):
+    while signature[i] == 'a':
+        i += 1
+    if signature[i] not in '({':
+        return i + 1
+    depth = 0
+    for j in range(i, len(signature)):
+        if signature[j] in '({':
+            depth += 1
+        elif signature[j] in ')}':
+            depth -= 1
+            if depth == 0:
+                return j + 1
+    raise ValueError("unbalanced signature %r" % signature)
+
+def guess_signature(value):
+    """ D-Bus type of a plain python value """
+    if isinstance(value, bool):
+        return 'b'
+    if isinstance(value, numbers.Integral):
+        return 'x'
+    if isinstance(value, numbers.Real):
+        return 'd'
+    if isinstance(value, _string_types):
+        return 's'
+    if isinstance(value, dict):
+        return 'a{sv}'
+    if isinstance(value, tuple):
+        return '(%s)' % ''.join(guess_signature(v) for v in value)
+    if isinstance(value, list):
+        return 'a' + (guess_signature(value[0]) if value else 's')
+    raise TypeError("no D-Bus type for %r" % (value,))
+
+def parse_introspection(xml):
+    """ {interface: {'methods': {name: (in, out)}, 'signals': {name: sig},
+        'properties': {name: (type, access)}}} """
+    interfaces = {}
+    for node in ElementTree.fromstring(xml).findall('interface'):
+        methods = {}
+        for method in node.findall('method'):
+            args = method.findall('arg')
+            methods[method.get('name')] = (
+                    ''.join(a.get('type') for a in args
+                        if a.get('direction', 'in') == 'in'),
+                    ''.join(a.get('type') for a in args
+                        if a.get('direction') == 'out'))
+        signals = dict((signal.get('name'),
+                ''.join(a.get('type') for a in signal.findall('arg')))
+                for signal in node.findall('signal'))
+        properties = dict((prop.get('name'), (prop.get('type'), prop.get('access')))
+                for prop in node.findall('property'))
+        interfaces[node.get('name')] = {
+            'methods': methods,
+            'signals': signals,
+            'properties': properties,
+        }
+    return interfaces
+
+class Marshaller(object):
+    """ turns the plain values of the adapter into a bus library's values
+
+        Variants get the type of the property (or metadata entry) they are
+        named after, or one guessed from their value. Backends override the
+        hooks for the kinds of values they need to wrap.
+        """
+
+    def __init__(self, variant_types):
+        self.variant_types = variant_types
+        # property name -> (value, converted), values are never modified
+        self._converted = {}
+
+    def convert(self, signature, value, name=None):
+        if signature == 'v':
+            if name is not None:
+                cached = self._converted.get(name)
+                if cached is not None and cached[0] is value:
+                    return cached[1]
+            inner = self.variant_types.get(name) or guess_signature(value)
+            converted = self.variant(inner, self.convert(inner, value, name))
+            if name is not None:
+                self._converted[name] = (value, converted)
+            return converted
+        if signature.startswith('a{'):
+            key_signature, value_signature = split_signature(signature[2:-1])
+            return self.dict(signature, dict(
+                (self.convert(key_signature, k), self.convert(value_signature, v, k))
+                for k, v in value.items()))
+        if signature[0] == 'a':
+            return self.array(signature,
+                    [self.convert(signature[1:], v) for v in value])
+        if signature[0] == '(':
+            return self.struct(signature, tuple(self.convert(s, v)
+                for s, v in zip(split_signature(signature[1:-1]), value)))
+        return self.basic(signature, value)
+
+    def convert_args(self, signature, values, name=None):
+        """ a tuple of values for the complete types of signature """
+        return tuple(self.convert(s, v, name)
+                for s, v in zip(split_signature(signature), values))
+
+    def forget(self):
+        self._converted.clear()
+
+    def variant(self, signature, value):
+        return value
+
+    def dict(self, signature, value):
+        return value
+
+    def array(self, signature, value):
+        return value
+
+    def struct(self, signature, value):
+        return value
+
+    def basic(self, signature, value):
+        return value
+
+class Transport(object):
+    """ exports an adapter on the bus
+
+        The adapter only deals with plain python values; methods, signals
+        and property types are taken from its introspection data.
+        """
+
+    name = None
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+        self.interfaces = parse_introspection(adapter.introspection)
+        self._methods = {}
+        for interface, info in self.interfaces.items():
+            for member, signatures in info['methods'].items():
+                self._methods[(interface, member)] = signatures
+                # the interface is optional in method calls
+                self._methods.setdefault((None, member), signatures)
+        adapter.transport = self
+        adapter.listeners.watch = self.watch_peer
+
+    def start(self, bus_name, object_path):
+        """ export the adapter at object_path and claim bus_name """
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def emit_signal(self, interface, name, args):
+        raise NotImplementedError
+
+    def watch_peer(self, name, vanished):
+        """ call vanished() once name leaves the bus, returns a function
+            cancelling the watch """
+        raise NotImplementedError
+
+    def get_signature(self, interface, member):
+        """ (in, out) signatures of a method, None if there is none """
+        return self._methods.get((interface or None, member))
+
+    def get_variant_name(self, member, args):
+        """ the variant returned by Get is typed after its property """
+        if member == 'Get' and len(args) == 2:
+            return args[1]
+        return None
+
+    def call(self, interface, member, args, sender, reply, error):
+        """ run a method of the adapter, handing its result to reply(value)
+            or the exception it raised to error(exception) """
+        start = time.time()
+        if TRACE.enabled:
+            TRACE.add('call', "%s.%s from %s" % (interface, member, sender))
+        self.adapter.listeners.seen(sender)
+        try:
+            method = getattr(self.adapter, member)
+            if member in self.adapter.async_methods:
+                method(*args, reply_handler=reply, error_handler=error)
+            else:
+                reply(method(*args))
+        except Exception as ex:
+            logger.debug("%s.%s failed", interface, member, exc_info=True)
+            error(ex)
+        finally:
+            STATS.record('dbus.%s' % member, time.time() - start)
+
+    @staticmethod
+    def error_name(exception):
+        return getattr(exception, '_dbus_error_name', None) or \
+                'org.freedesktop.DBus.Python.%s' % type(exception).__name__
+
+def gdbus_available():
+    """ whether the GDBus backend can be loaded next to the bindings
+        already in use """
+    # the static PyGTK bindings and gi can't live in the same process
+    glib_module = sys.modules.get('glib')
+    if glib_module is not None and glib_module.__name__ == 'glib':
+        return False
+    try:
+        from gi.repository import Gio, GLib
+    except ImportError:
+        return False
+    return True
+
+def create_transport(adapter, name='auto'):
+    """ the transport called name, exporting adapter
+
+        Falls back to dbus-python when GDBus can't be used here, rather
+        than leaving the plugin half enabled.
+        """
+    if name not in ('auto', 'gdbus', 'dbus-python'):
+        logger.warning("Unknown transport %r, picking one", name)
+        name = 'auto'
+    if name == 'auto':
+        name = 'gdbus' if gdbus_available() else 'dbus-python'
+    elif name == 'gdbus' and not gdbus_available():
+        logger.warning("GDBus can't be used next to the bindings loaded, "
+                "using dbus-python")
+        name = 'dbus-python'
+    if name == 'gdbus':
+        from gdbus_transport import GDBusTransport
+        transport = GDBusTransport(adapter)
+    else:
+        from dbus_transport import DBusPythonTransport
+        transport = DBusPythonTransport(adapter)
+    logger.info("Exporting on D-Bus with %s", transport.name)
+    return transport
@@ -0,0 +1,104 @@
+# vim: ts=4:sw=4:et:
+#
+# Copyright (C) 2010 Sun Ning <classicning@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+#
+
+import glib
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+logger = logging.getLogger(__name__)
+
+class WorkerPool(object):
+    """ a few daemon threads running jobs off the GTK main loop
+
+        Results are handed back to their callback on the main loop, and
+        the exceptions of failed jobs to their errback.
+        """
+
+    def __init__(self, name, size=2):
+        self.name = name
+        self.size = size
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._stopped = False
+
+    def submit(self, func, args=(), callback=None, errback=None):
+        """ run func(*args) in a worker thread, then callback(result)
+            on the main loop, or errback(exception) if it raised """
+        if self._stopped:
+            return
+        if not self._threads:
+            self._start()
+        self._jobs.put((func, args, callback, errback))
+
+    def stop(self):
+        """ drop queued jobs and let the threads exit; results of the
+            jobs still running are discarded """
+        self._stopped = True
+        try:
+            while True:
+                self._jobs.get_nowait()
+        except queue.Empty:
+            pass
+        for thread in self._threads:
+            self._jobs.put(None)
+        self._threads = []
+
+    def _start(self):
+        for i in range(self.size):
+            thread = threading.Thread(target=self._run,
+                    name="%s-%d" % (self.name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            func, args, callback, errback = job
+            try:
+                result = func(*args)
+            except Exception as ex:
+                logger.exception("%s: job %r failed", self.name, func)
+                if errback is not None:
+                    glib.idle_add(self._deliver, errback, ex)
+                continue
+            if callback is not None:
+                glib.idle_add(self._deliver, callback, result)
+
+    def _deliver(self, callback, result):
+        if not self._stopped:
+            callback(result)
+        return False